@@ -1,5 +1,9 @@
+import io
+import numpy as np
 import networkx as nx
-from matplotlib import pyplot as plt
+from matplotlib import image as mpimg
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 
 state_name_mappings = {
     "SCAN": "S",
@@ -198,31 +202,250 @@ def my_draw_networkx_edge_labels(
 
     return text_items
 
-def graph_abstract_machine(logic, current_state=None):
-    plt.figure(figsize=(10,10))
+# Laid out graphs of the most recently drawn machines
+graph_cache = {}
+GRAPH_CACHE_SIZE = 4
+# Machines with more states than this are shown as the neighbourhood of the current state
+NEIGHBOURHOOD_THRESHOLD = 40
+# Neighbourhood views kept per machine, keyed by their centre state
+VIEW_CACHE_SIZE = 4
+
+def build_graph(logic):
     G = nx.DiGraph()
-    edge_list = build_edge_list(logic)
-    G.add_edges_from(edge_list)
-    node_colors = []
-    for node in G.nodes():
-        if node == current_state:
-            node_colors.append("cyan")
+    G.add_edges_from(build_edge_list(logic))
+    return G
+
+def layered_layout(G, start=None):
+    """Places the states in breadth-first layers from the start state, one column per layer.
+
+    States that cannot be reached from the start state are laid out from the first of
+    them in the same way. Each layer is ordered by the average position of the states
+    that lead into it from the previous layer, which keeps most edges from crossing.
+    """
+    layers = []
+    layer_of = {}
+    roots = ([start] if start in G else []) + list(G.nodes())
+    for root in roots:
+        if root in layer_of:
+            continue
+        layer_of[root] = 0
+        frontier = [root]
+        depth = 0
+        while len(frontier) > 0:
+            if depth == len(layers):
+                layers.append([])
+            layers[depth].extend(frontier)
+            next_frontier = []
+            for node in frontier:
+                for successor in G.successors(node):
+                    if successor not in layer_of:
+                        layer_of[successor] = depth + 1
+                        next_frontier.append(successor)
+            frontier = next_frontier
+            depth += 1
+
+    rank = {}
+    for depth in range(len(layers)):
+        if depth > 0:
+            def barycentre(node):
+                ranks = [rank[p] for p in G.predecessors(node) if layer_of[p] == depth - 1]
+                return sum(ranks) / len(ranks) if len(ranks) > 0 else float("inf")
+            layers[depth].sort(key=barycentre)
+        for i, node in enumerate(layers[depth]):
+            rank[node] = i
+
+    pos = {}
+    for depth in range(len(layers)):
+        middle = (len(layers[depth]) - 1) / 2
+        for node in layers[depth]:
+            pos[node] = np.array([float(depth), middle - rank[node]])
+    return pos
+
+class MachineGraph:
+    """A machine graph that is laid out and drawn once.
+
+    The figure is rendered twice up front, with every state node yellow and with every
+    state node cyan. Highlighting a state then only copies the pixels of its node from
+    the cyan rendering into the yellow one, without drawing the figure again.
+    """
+
+    def __init__(self, G, pos=None):
+        # Draw on a figure of our own, outside of pyplot's global state
+        self.figure = Figure(figsize=(10,10))
+        self.canvas = FigureCanvasAgg(self.figure)
+        ax = self.figure.add_subplot()
+
+        self.node_list = list(G.nodes())
+        self.node_index = {node: i for i, node in enumerate(self.node_list)}
+        if len(self.node_list) == 0:
+            raise Exception("Machine has no transitions to graph")
+
+        node_size = 2000
+        if pos == None:
+            pos = nx.spring_layout(G, seed=42)
+        nodes = nx.draw_networkx_nodes(G, pos, node_color=["yellow"] * len(self.node_list), node_size=node_size, edgecolors="black", margins=0.01, ax=ax)
+        nx.draw_networkx_labels(G, pos, ax=ax)
+        curved_edges = [edge for edge in G.edges() if reversed(edge) in G.edges()]
+        straight_edges = list(set(G.edges()) - set(curved_edges))
+        nx.draw_networkx_edges(G, pos, edgelist=straight_edges, node_size=node_size, ax=ax)
+        arc_rad = 0.25
+        nx.draw_networkx_edges(G, pos, edgelist=curved_edges, connectionstyle=f'arc3, rad = {arc_rad}', node_size=node_size, ax=ax)
+        edge_weights = nx.get_edge_attributes(G,'w')
+        curved_edge_labels = {edge: edge_weights[edge] for edge in curved_edges}
+        straight_edge_labels = {edge: edge_weights[edge] for edge in straight_edges}
+        my_draw_networkx_edge_labels(G, pos, edge_labels=curved_edge_labels,rotate=False,rad = arc_rad,ax=ax)
+        nx.draw_networkx_edge_labels(G, pos, edge_labels=straight_edge_labels,rotate=False,ax=ax)
+
+        self.canvas.draw()
+        self.yellow = np.array(self.canvas.buffer_rgba())
+        nodes.set_facecolor(["cyan"] * len(self.node_list))
+        self.canvas.draw()
+        self.cyan = np.array(self.canvas.buffer_rgba())
+        self.height, self.width = self.yellow.shape[:2]
+
+        # Node centres in pixels, with rows counted from the top of the image
+        centres = ax.transData.transform(np.array([pos[node] for node in self.node_list]))
+        self.centres = np.column_stack([self.height - centres[:, 1], centres[:, 0]])
+        # Node marker sizes are areas in points squared, plus a pixel for the border
+        self.radius = np.sqrt(node_size) / 2 * self.figure.dpi / 72 + 1
+
+    def render_rgba(self, current_state=None):
+        """Returns the graph as an RGBA array with the current state (or else the first state) highlighted"""
+        if current_state not in self.node_index:
+            current_state = self.node_list[0]
+        index = self.node_index[current_state]
+        image = self.yellow.copy()
+
+        row, column = self.centres[index]
+        radius = self.radius
+        top, bottom = max(0, int(row - radius)), min(self.height, int(row + radius) + 2)
+        left, right = max(0, int(column - radius)), min(self.width, int(column + radius) + 2)
+        if top >= bottom or left >= right:
+            return image
+        rows, columns = np.mgrid[top:bottom, left:right]
+        inside = (rows - row) ** 2 + (columns - column) ** 2 <= radius ** 2
+
+        # Nodes drawn after this one cover it where they overlap
+        later = self.centres[index + 1:]
+        overlapping = later[((later - self.centres[index]) ** 2).sum(axis=1) <= (2 * radius) ** 2]
+        for other_row, other_column in overlapping:
+            inside &= (rows - other_row) ** 2 + (columns - other_column) ** 2 > radius ** 2
+
+        window = image[top:bottom, left:right]
+        window[inside] = self.cyan[top:bottom, left:right][inside]
+        return image
+
+    def render(self, current_state=None):
+        """Returns the graph as PNG bytes with the current state (or else the first state) highlighted"""
+        return encode_png(self.render_rgba(current_state))
+
+class NeighbourhoodGraph:
+    """Graph mode for large machines that only draws the states near the current state"""
+
+    def __init__(self, G, start=None, hops=2, max_states=40):
+        if G.number_of_nodes() == 0:
+            raise Exception("Machine has no transitions to graph")
+        self.G = G
+        self.start = start if start in G else next(iter(G.nodes()))
+        self.hops = hops
+        self.max_states = max_states
+        # The whole machine is laid out once, and each view keeps its order
+        self.pos = layered_layout(G, self.start)
+        # centre -> (MachineGraph, states whose neighbours are all in the view)
+        self.views = {}
+
+    def neighbourhood(self, centre):
+        # States within hops transitions either way, closest first and at most max_states of them
+        distance = {centre: 0}
+        frontier = [centre]
+        while len(frontier) > 0 and len(distance) < self.max_states:
+            next_frontier = []
+            for node in frontier:
+                # Do not spread out through hubs such as accept, which most states lead to
+                if distance[node] == self.hops or (node != centre and self.G.degree(node) > self.max_states):
+                    continue
+                for neighbour in list(self.G.successors(node)) + list(self.G.predecessors(node)):
+                    if neighbour not in distance and len(distance) < self.max_states:
+                        distance[neighbour] = distance[node] + 1
+                        next_frontier.append(neighbour)
+            frontier = next_frontier
+        return distance
+
+    def compact_positions(self, states):
+        # Keep the layer order and the order within each layer, but close the gaps left by the states not shown
+        columns = sorted(set(self.pos[node][0] for node in states))
+        column_of = {x: i for i, x in enumerate(columns)}
+        layers = [[] for _ in columns]
+        for node in states:
+            layers[column_of[self.pos[node][0]]].append(node)
+        pos = {}
+        for i in range(len(layers)):
+            layers[i].sort(key=lambda node: -self.pos[node][1])
+            middle = (len(layers[i]) - 1) / 2
+            for rank, node in enumerate(layers[i]):
+                pos[node] = np.array([float(i), middle - rank])
+        return pos
+
+    def view(self, current_state):
+        # A view is reused while the current state stays inside it with all of its neighbours
+        for centre, (graph, interior) in self.views.items():
+            if current_state == centre or current_state in interior:
+                return graph
+
+        states = self.neighbourhood(current_state)
+        # Keep the machine's node order so the drawing does not depend on the centre
+        subgraph = nx.DiGraph()
+        subgraph.add_nodes_from(node for node in self.G.nodes() if node in states)
+        subgraph.add_edges_from((u, v, data) for u, v, data in self.G.edges(data=True) if u in states and v in states)
+        graph = MachineGraph(subgraph, pos=self.compact_positions(states))
+        interior = set(node for node in states if all(neighbour in states for neighbour in nx.all_neighbors(self.G, node)))
+
+        if len(self.views) >= VIEW_CACHE_SIZE:
+            del self.views[next(iter(self.views))]
+        self.views[current_state] = (graph, interior)
+        return graph
+
+    def render_rgba(self, current_state=None):
+        """Returns the neighbourhood of the current state (or else the start state) as an RGBA array"""
+        if current_state not in self.G:
+            current_state = self.start
+        return self.view(current_state).render_rgba(current_state)
+
+    def render(self, current_state=None):
+        return encode_png(self.render_rgba(current_state))
+
+def encode_png(image):
+    buffer = io.BytesIO()
+    mpimg.imsave(buffer, image, format="png")
+    return buffer.getvalue()
+
+def cached_machine_graph(logic, mode=None, hops=2):
+    """Returns the graph of the logic, reusing the cached one while the states and transitions are unchanged.
+
+    mode is "full" for a MachineGraph of every state or "neighbourhood" for a
+    NeighbourhoodGraph; by default machines with more than NEIGHBOURHOOD_THRESHOLD
+    states use the neighbourhood mode.
+    """
+    if mode == None:
+        mode = "neighbourhood" if len(logic) > NEIGHBOURHOOD_THRESHOLD else "full"
+    key = (mode, hops, tuple((state, logic[state]["instruction"], tuple(logic[state]["arguments"])) for state in logic.keys()))
+    graph = graph_cache.pop(key, None)
+    if graph == None:
+        if mode == "full":
+            graph = MachineGraph(build_graph(logic))
+        elif mode == "neighbourhood":
+            graph = NeighbourhoodGraph(build_graph(logic), start=next(iter(logic.keys()), None), hops=hops)
         else:
-            node_colors.append("yellow")
-    if "cyan" not in node_colors:
-        node_colors[0] = "cyan"
-    pos = nx.spring_layout(G, seed=42)
-    nx.draw_networkx_nodes(G, pos, node_color=node_colors, node_size=2000, edgecolors="black", margins=0.01)
-    nx.draw_networkx_labels(G, pos)
-    curved_edges = [edge for edge in G.edges() if reversed(edge) in G.edges()]
-    straight_edges = list(set(G.edges()) - set(curved_edges))
-    nx.draw_networkx_edges(G, pos, edgelist=straight_edges, node_size=2000)
-    arc_rad = 0.25
-    nx.draw_networkx_edges(G, pos, edgelist=curved_edges, connectionstyle=f'arc3, rad = {arc_rad}', node_size=2000)
-    edge_weights = nx.get_edge_attributes(G,'w')
-    curved_edge_labels = {edge: edge_weights[edge] for edge in curved_edges}
-    straight_edge_labels = {edge: edge_weights[edge] for edge in straight_edges}
-    my_draw_networkx_edge_labels(G, pos, edge_labels=curved_edge_labels,rotate=False,rad = arc_rad)
-    nx.draw_networkx_edge_labels(G, pos, edge_labels=straight_edge_labels,rotate=False)
-    plt.savefig("graph_abstract_machine.png")
-    plt.close()
\ No newline at end of file
+            raise Exception("Unknown graph mode: " + str(mode))
+        if len(graph_cache) >= GRAPH_CACHE_SIZE:
+            del graph_cache[next(iter(graph_cache))]
+    # Most recently used last
+    graph_cache[key] = graph
+    return graph
+
+def render_abstract_machine(logic, current_state=None, mode=None):
+    return cached_machine_graph(logic, mode=mode).render(current_state)
+
+def graph_abstract_machine(logic, current_state=None, mode=None):
+    with open("graph_abstract_machine.png", "wb") as file:
+        file.write(render_abstract_machine(logic, current_state, mode=mode))
\ No newline at end of file
@@ -1,22 +1,178 @@
-import re
-from aux_data_structures import Stack, Queue, Tape, InputTape
+import re, time
+from aux_data_structures import Stack, Queue, Tape, InputTape, StreamingInputTape, OutputSink, fingerprinted, copy_structure
+from event_log import format_event, EVENT_START, EVENT_ACCEPT, EVENT_REJECT, EVENT_HALT, EVENT_READ, EVENT_READ_RIGHT, EVENT_READ_LEFT, EVENT_READ_MEMORY, EVENT_WRITE, EVENT_PRINT, EVENT_REPLACE, EVENT_TRANSITION, EVENT_TRANSITIONING, EVENT_NO_TRANSITION, EVENT_LOOP
+from machine_compiler import CompiledMachine, OP_SCAN, OP_SCAN_RIGHT, OP_SCAN_LEFT, OP_READ, OP_WRITE, OP_PRINT, OP_RIGHT, OP_LEFT, OP_ERROR, ACCEPT, REJECT, HALT, NO_TRANSITION, NONDETERMINISTIC
+
+# Halt reasons
+terminal_halt_reasons = {ACCEPT: "accept", REJECT: "reject", HALT: "halt"}
+
+# Number of instructions executed between wall-clock checks in run_fast()
+DEADLINE_CHECK_INTERVAL = 8192
+
+# Number of instructions executed between configuration samples when detecting loops
+LOOP_CHECK_INTERVAL = 1024
+
+# Aux data name in an instruction such as READ(S1)
+associated_data_pattern = re.compile(r"\([a-zA-Z0-9_]{1,}\)")
+
+class RunResult:
+    def __init__(self, accepted, halt_reason, steps, output, error=None):
+        self.accepted = accepted
+        # One of accept, reject, halt, no_transition, looping, max_steps, timeout or error
+        self.halt_reason = halt_reason
+        self.steps = steps
+        self.output = output
+        self.error = error
+
+    def __repr__(self):
+        retstring = "RunResult(accepted=" + str(self.accepted) + ", halt_reason=" + str(self.halt_reason) + ", steps=" + str(self.steps) + ", output=" + repr(self.output)
+        if self.error != None:
+            retstring += ", error=" + repr(self.error)
+        return retstring + ")"
+
+class LoopDetector:
+    """Detects an infinite loop by spotting a repeated configuration with Brent's cycle detection"""
+    def __init__(self, machine):
+        self.machine = machine
+        # Whether the input head only moves right over a tape that is not memory too
+        self.one_way = OP_SCAN_LEFT not in machine.compiled.opcodes
+        # Memory is swapped for structures that hash their contents incrementally
+        for key in machine.memory.keys():
+            memory = fingerprinted(machine.memory[key])
+            if machine.memory[key] is machine.input_tape:
+                machine.input_tape = memory
+                self.one_way = False
+            machine.memory[key] = memory
+        self.checkpoint = None
+        self.configuration = None
+        self.power = 1
+        self.length = 0
+
+    def input_head(self):
+        tape = self.machine.input_tape
+        if self.one_way:
+            # Past the input a head that never moves left only reads blanks, so where it is no longer matters
+            if isinstance(tape, StreamingInputTape):
+                if tape.exhausted:
+                    return -1
+            elif self.machine.input_string != None and tape.head >= len(self.machine.input_string) - 1:
+                return -1
+        return tape.head
+
+    def fingerprint(self):
+        machine = self.machine
+        return hash((machine.current_state, self.input_head(), tuple(memory.fingerprint() for memory in machine.memory.values())))
+
+    def exact_configuration(self):
+        machine = self.machine
+        return (machine.current_state, self.input_head(), tuple(memory.contents() for memory in machine.memory.values()))
+
+    def check(self):
+        """Samples the current configuration and returns True if it repeats the checkpoint"""
+        fingerprint = self.fingerprint()
+        # A deterministic machine that repeats a configuration repeats it forever
+        if fingerprint == self.checkpoint and self.exact_configuration() == self.configuration:
+            return True
+        self.length += 1
+        # A single checkpoint moves forward at powers of two, so memory stays bounded
+        if self.checkpoint == None or self.length == self.power:
+            self.checkpoint = fingerprint
+            self.configuration = self.exact_configuration()
+            self.power *= 2
+            self.length = 0
+        return False
 
 class AbstractMachineSimulator:
-    def __init__(self, machine_definition) -> None:
+    def __init__(self, machine_definition, state_map=None, compiled=None) -> None:
 
         self.aux_data = None
         self.input_tape = None
 
+        # Verbose events go to this EventSink instead of print and the logger when set
+        self.event_sink = None
+        # PRINT output goes to this OutputSink instead of a list when set
+        self.output_sink = None
+
         self.logic = machine_definition["logic"]
         self.aux_data = machine_definition["aux_data"]
 
+        # Lifecycle and memory
+        self.reset()
+
+        # Build the state map, unless a prebuilt one was given (see machine_cache)
+        self.state_map = state_map
+        if self.state_map == None:
+            self.state_map = {}
+            for key in self.logic.keys():
+                self.state_map[key] = self.build_state(key)
+
+        # Compile the state map into integer transition tables
+        self.compiled = compiled
+        if self.compiled == None:
+            self.compiled = CompiledMachine(self.state_map, self.aux_data)
+
+    def build_state(self, key):
+        state = {
+            "instruction": None,
+            "associated_data": None,
+            "transitions": {}
+        }
+        # Set the transitions
+        for t in self.logic[key]["arguments"]:
+            t = t.split(",")
+            transition = (t[0][1:], t[1][:-1])
+            state["transitions"][transition[0]] = transition[1]
+
+        # Check the instruction for an aux data
+        data = associated_data_pattern.findall(self.logic[key]["instruction"])
+        if len(data) > 0:
+            # Get the aux data
+            state["associated_data"] = data[0][1:-1]
+            # Remove the aux data from the instruction
+            state["instruction"] = self.logic[key]["instruction"].replace("(" + data[0][1:-1] + ")", "")
+        else:
+            state["instruction"] = self.logic[key]["instruction"]
+        return state
+
+    def apply_changes(self, aux_data_changes, logic_changes):
+        """Rebuilds the states changed by InputParser.update() and resets the machine.
+
+        The logic and aux_data dictionaries are the ones the parser patched in place, so
+        only the state map entries named in logic_changes are built and compiled again.
+        """
+        for key in logic_changes:
+            if key in self.logic:
+                self.state_map[key] = self.build_state(key)
+            elif key in self.state_map:
+                del self.state_map[key]
+
+        # Follow the declaration order, which decides the start state
+        if list(self.state_map.keys()) != list(self.logic.keys()):
+            state_map = {key: self.state_map[key] for key in self.logic.keys()}
+            self.state_map.clear()
+            self.state_map.update(state_map)
+
+        if len(aux_data_changes) > 0:
+            self.compiled = CompiledMachine(self.state_map, self.aux_data)
+        else:
+            self.compiled.update(self.state_map, self.aux_data, logic_changes)
+        self.reset()
+
+    def reset(self):
+        """Returns the machine to its initial configuration without rebuilding the state map"""
         # Lifecycle
+        self.input_tape = None
+        # The string the input tape was set from, when it was set from one
+        self.input_string = None
         self.accepted = False
         self.halted = False
         self.current_state = None
         self.input_tapehead_idx = 0
-        self.output = []
-        
+        # A list of printed symbols, or the attached OutputSink which carries on across resets
+        self.output = [] if self.output_sink == None else self.output_sink
+        self.halt_reason = None
+        self.steps = 0
+
         # Memory
         self.memory = {}
 
@@ -31,30 +187,6 @@ class AbstractMachineSimulator:
             else:
                 raise Exception("Unknown aux data type: " + self.aux_data[key]["type"])
 
-        # Build the state map
-        self.state_map = {}
-        for key in self.logic.keys():
-            self.state_map[key] = {
-                "instruction": None,
-                "associated_data": None,
-                "transitions": {}
-            }
-            # Set the transitions
-            for t in self.logic[key]["arguments"]:
-                t = t.split(",")
-                transition = (t[0][1:], t[1][:-1])
-                self.state_map[key]["transitions"][transition[0]] = transition[1]
-
-            # Check the instruction for an aux data
-            data = re.findall("\([a-zA-Z0-9_]{1,}\)", self.logic[key]["instruction"])
-            if len(data) > 0:
-                # Get the aux data
-                self.state_map[key]["associated_data"] = data[0][1:-1]
-                # Remove the aux data from the instruction
-                self.state_map[key]["instruction"] = self.logic[key]["instruction"].replace("(" + data[0][1:-1] + ")", "")
-            else:
-                self.state_map[key]["instruction"] = self.logic[key]["instruction"]
-
     def set_input_tape(self, input_tape, is_turing_machine=False):
         # Ensure that the input tape is a string with the first and last character as #
         if not isinstance(input_tape, str):
@@ -64,6 +196,7 @@ class AbstractMachineSimulator:
         
         # Turn the input tape into a Tape of type InputTape
         self.input_tape = InputTape(input_tape)
+        self.input_string = input_tape
 
         # If this is a Turing machine, set the input tape to the first declared tape aux data
         if is_turing_machine:
@@ -72,6 +205,107 @@ class AbstractMachineSimulator:
                     self.memory[key] = self.input_tape
                     break
 
+    def log(self, code, arguments, verbose, logger):
+        if not verbose:
+            return
+        # With an event sink the message is only formatted when the sink is read
+        if self.event_sink != None:
+            self.event_sink.emit(code, arguments)
+            return
+        message = format_event(code, arguments)
+        print(message)
+        if logger: logger(message)
+
+    def snapshot(self):
+        """Returns a copy of the complete run state, which restore() can return to later in the same run"""
+        if isinstance(self.input_tape, StreamingInputTape):
+            raise Exception("Cannot snapshot a machine reading a streamed input")
+        if self.output_sink != None:
+            raise Exception("Cannot snapshot a machine whose output is streamed")
+
+        memory = {}
+        input_key = None
+        for key in self.memory.keys():
+            memory[key] = copy_structure(self.memory[key])
+            if self.memory[key] is self.input_tape:
+                input_key = key
+        return {
+            "current_state": self.current_state,
+            "accepted": self.accepted,
+            "halted": self.halted,
+            "halt_reason": self.halt_reason,
+            "steps": self.steps,
+            # Output lists are only ever appended to, so its length is enough
+            "output": len(self.output),
+            "memory": memory,
+            # Unless it is a Turing machine's tape the input tape is never written, so its cells can be shared
+            "input_key": input_key,
+            "input_tape": copy_structure(self.input_tape, share_buffers=True) if input_key == None and self.input_tape != None else None
+        }
+
+    def restore(self, snapshot):
+        """Returns the machine to a snapshot() taken earlier in the current run"""
+        if len(self.output) < snapshot["output"]:
+            raise Exception("Cannot restore a snapshot taken after the current step")
+        self.memory = {key: copy_structure(memory) for key, memory in snapshot["memory"].items()}
+        if snapshot["input_key"] != None:
+            self.input_tape = self.memory[snapshot["input_key"]]
+        elif snapshot["input_tape"] != None:
+            self.input_tape = copy_structure(snapshot["input_tape"], share_buffers=True)
+        # A new list, so that the one the snapshot was taken from is still only appended to
+        self.output = self.output[:snapshot["output"]]
+        self.current_state = snapshot["current_state"]
+        self.accepted = snapshot["accepted"]
+        self.halted = snapshot["halted"]
+        self.halt_reason = snapshot["halt_reason"]
+        self.steps = snapshot["steps"]
+
+    def set_input_stream(self, source, chunk_size=65536, encoding="utf-8"):
+        """Reads the input from an iterator of strings, a file object or an mmap instead of a string.
+
+        The source holds the symbols between the # sentinels and is consumed chunk by chunk,
+        so only machines that read their input with SCAN and never scan left can use it.
+        Machines with a tape cannot, since a Turing machine's input is copied onto its tape.
+        """
+        for key in self.aux_data.keys():
+            if self.aux_data[key]["type"] == "TAPE":
+                raise Exception("Streaming input requires a machine without tapes. " + key + " is a tape.")
+        for state in range(len(self.compiled.state_names)):
+            if self.compiled.opcodes[state] == OP_SCAN_LEFT:
+                raise Exception("Streaming input requires a machine that never scans left. State " + self.compiled.state_names[state] + " does.")
+        for key in self.state_map.keys():
+            if self.state_map[key]["instruction"] in ("RIGHT", "LEFT", "UP", "DOWN"):
+                raise Exception("Streaming input requires a machine that only scans its input. State " + key + " moves a tape.")
+
+        self.input_tape = StreamingInputTape(source, chunk_size=chunk_size, encoding=encoding)
+        self.input_string = None
+
+    def set_output_sink(self, target, flush_size=65536, encoding="utf-8"):
+        """Streams PRINT output to a writable file, a callable or an OutputSink instead of keeping it.
+
+        Pass None to collect the output in memory again. Streamed runs report None as their
+        RunResult output.
+        """
+        if target == None or isinstance(target, OutputSink):
+            self.output_sink = target
+        else:
+            self.output_sink = OutputSink(target, flush_size=flush_size, encoding=encoding)
+        self.output = [] if self.output_sink == None else self.output_sink
+        return self.output_sink
+
+    def flush_output(self):
+        """Flushes the output sink, and returns the output collected in memory or None when it was streamed"""
+        if self.output_sink != None:
+            self.output_sink.flush()
+            return None
+        return "".join(self.output)
+
+    def output_tail(self, count):
+        """Returns the last count symbols printed"""
+        if self.output_sink != None:
+            return self.output_sink.tail(count)
+        return "".join(self.output[-count:]) if count > 0 else ""
+
     def step(self, verbose=False, logger=None) -> bool:
         # If the input tape is not set yet, raise an error
         if self.input_tape == None:
@@ -81,259 +315,286 @@ class AbstractMachineSimulator:
         if self.halted:
             return False
         
+        compiled = self.compiled
+
         # If the current state is not set, set it to the first state
         if self.current_state == None:
-            first_state = list(self.state_map.keys())[0]
+            if compiled.start_state == None:
+                raise Exception("Machine has no states")
+            first_state = compiled.state_names[compiled.start_state]
             self.current_state = first_state
-            if verbose: 
-                print("Starting at state " + first_state)
-                if logger: logger("Starting at state " + first_state)
-            # Read the first sharp
-            # if(self.input_tape.read() != "#"):
-            #     raise Exception("Input tape must start with #")
-            # print("Read first #")
+            self.log(EVENT_START, (first_state,), verbose, logger)
+
+        state = compiled.state_ids[self.current_state]
 
         # Check if accepting or rejecting state
-        if self.current_state.lower() == "accept":
+        terminal = compiled.terminal[state]
+        if terminal == ACCEPT:
             self.accepted = True
             self.halted = True
-            if verbose: 
-                print("Accepted and halted.")
-                if logger: logger("Accepted and halted.")
+            self.halt_reason = "accept"
+            self.log(EVENT_ACCEPT, (), verbose, logger)
             return False
-        elif self.current_state.lower() == "reject":
+        elif terminal == REJECT:
             self.halted = True
-            if verbose: 
-                print("Rejected and halted.")
-                if logger: logger("Rejected and halted.")
+            self.halt_reason = "reject"
+            self.log(EVENT_REJECT, (), verbose, logger)
             return False
-        elif self.current_state.lower() == "halt":
+        elif terminal == HALT:
             self.halted = True
-            if verbose: 
-                print("Halted.")
-                if logger: logger("Halted.")
+            self.halt_reason = "halt"
+            self.log(EVENT_HALT, (), verbose, logger)
             return False
 
-        # Get the current state
-        current_state = self.state_map[self.current_state]
-        # Get the current instruction
-        instruction = current_state["instruction"]
-        # Get the current associated data
-        associated_data = current_state["associated_data"]
-        # Get the current transitions
-        transitions = current_state["transitions"]
+        opcode = compiled.opcodes[state]
+        if opcode == OP_ERROR:
+            raise Exception(compiled.errors[state])
+        self.steps += 1
 
-        symbol_buffer = ""
+        associated_data = None
+        if compiled.data[state] != -1:
+            associated_data = compiled.memory_keys[compiled.data[state]]
 
         # Execute the instruction
-        if instruction == "SCAN":
-            self.input_tape.move("R")
+        if opcode in (OP_SCAN, OP_SCAN_RIGHT, OP_SCAN_LEFT):
+            direction = "L" if opcode == OP_SCAN_LEFT else "R"
+            self.input_tape.move(direction)
             symbol_buffer = self.input_tape.read()
-            if verbose: 
-                print("Read symbol " + symbol_buffer)
-                if logger: logger("Read symbol " + symbol_buffer)
+            if opcode == OP_SCAN:
+                self.log(EVENT_READ, (symbol_buffer,), verbose, logger)
+            elif opcode == OP_SCAN_RIGHT:
+                self.log(EVENT_READ_RIGHT, (symbol_buffer,), verbose, logger)
+            else:
+                self.log(EVENT_READ_LEFT, (symbol_buffer,), verbose, logger)
+            self.transition(state, symbol_buffer, verbose, logger)
 
-            # Transition to the next state
-            if symbol_buffer in transitions.keys():
-                self.current_state = transitions[symbol_buffer]
-                if verbose: 
-                    print("Transitioned to state " + self.current_state)
-                    if logger: logger("Transitioned to state " + self.current_state)
+        elif opcode == OP_WRITE:
+            symbol_buffer = compiled.emit[state]
+            memory = self.memory[associated_data]
+            if isinstance(memory, Stack):
+                memory.push(symbol_buffer)
             else:
-                self.halted = True
-                if verbose: 
-                    print("No transitions found for this symbol. Halted.")
-                    if logger: logger("No transitions found for this symbol. Halted.")
-        elif instruction == "WRITE":
-            if associated_data == None:
-                raise Exception("WRITE instruction requires associated data")
-            
-            # Grab the value to write from the transitions
-            keys = transitions.keys()
-            if len(keys) > 1:
-                raise Exception("WRITE instruction can only have one transition.")
-            symbol_buffer = list(keys)[0]
-
-            # Get the data type and write accordingly
-            if isinstance(self.memory[associated_data], Stack):
-                self.memory[associated_data].push(symbol_buffer)
-            elif isinstance(self.memory[associated_data], Queue):
-                self.memory[associated_data].enqueue(symbol_buffer)
-            elif isinstance(self.memory[associated_data], Tape):
-                raise Exception("Tape is not a valid data type for WRITE instruction")
-            if verbose: 
-                print("Wrote symbol " + symbol_buffer + " to " + associated_data)
-                if logger: logger("Wrote symbol " + symbol_buffer + " to " + associated_data)
+                memory.enqueue(symbol_buffer)
+            self.log(EVENT_WRITE, (symbol_buffer, associated_data), verbose, logger)
 
             # Transition to the next state
-            self.current_state = transitions[symbol_buffer]
-            if verbose: 
-                print("Transitioned to state " + self.current_state)
-                if logger: logger("Transitioned to state " + self.current_state)
-
-        elif instruction == "READ":
-            if associated_data == None:
-                raise Exception("READ instruction requires associated data")
-            # Get the data type and read accordingly
-            if isinstance(self.memory[associated_data], Stack):
-                symbol_buffer = self.memory[associated_data].pop()
-            elif isinstance(self.memory[associated_data], Queue):
-                symbol_buffer = self.memory[associated_data].dequeue()
-            elif isinstance(self.memory[associated_data], Tape):
-                raise Exception("Tape is not a valid data type for READ instruction")
-            if verbose: 
-                print("Read symbol " + symbol_buffer + " from " + associated_data)
-                if logger: logger("Read symbol " + symbol_buffer + " from " + associated_data)
-
-            # Transition to the next state based on the sybmol buffer
-            if symbol_buffer in transitions.keys():
-                self.current_state = transitions[symbol_buffer]
-                if verbose: 
-                    print("Transitioned to state " + self.current_state)
-                    if logger: logger("Transitioned to state " + self.current_state)
+            self.current_state = compiled.state_names[compiled.next_state[state]]
+            self.log(EVENT_TRANSITION, (self.current_state,), verbose, logger)
+
+        elif opcode == OP_READ:
+            memory = self.memory[associated_data]
+            if isinstance(memory, Stack):
+                symbol_buffer = memory.pop()
             else:
-                self.halted = True
-                if verbose: 
-                    print("No transitions found for this symbol. Halted.")
-                    if logger: logger("No transitions found for this symbol. Halted.")
-
-        elif instruction == "PRINT":
-            # Get the value to print from the transitions
-            keys = transitions.keys()
-            if len(keys) > 1:
-                raise Exception("PRINT instruction can only have one transition.")
-            symbol_buffer = list(keys)[0]
-
-            # Print the symbol buffer
+                symbol_buffer = memory.dequeue()
+            self.log(EVENT_READ_MEMORY, (symbol_buffer, associated_data), verbose, logger)
+            self.transition(state, symbol_buffer, verbose, logger)
+
+        elif opcode == OP_PRINT:
+            symbol_buffer = compiled.emit[state]
             self.output.append(symbol_buffer)
-            if verbose: 
-                print("Printed symbol " + symbol_buffer)
-                if logger: logger("Printed symbol " + symbol_buffer)
+            # Stepping streams every symbol as it is printed
+            if self.output_sink != None:
+                self.output_sink.flush()
+            self.log(EVENT_PRINT, (symbol_buffer,), verbose, logger)
 
             # Transition to the next state
-            self.current_state = transitions[symbol_buffer]
-            if verbose: 
-                print("Transitioned to state " + self.current_state)
-                if logger: logger("Transitioned to state " + self.current_state)
-
-        elif instruction == "SCAN RIGHT":
-            # Move the tape head right
-            self.input_tape.move("R")
-            symbol_buffer = self.input_tape.read()
-            if verbose: 
-                print("Read symbol " + symbol_buffer + " from the right")
-                if logger: logger("Read symbol " + symbol_buffer + " from the right")
-
-            # Transition to the next state based on symbol read
-            if symbol_buffer in transitions.keys():
-                self.current_state = transitions[symbol_buffer]
-                if verbose: 
-                    print("Transitioned to state " + self.current_state)
-                    if logger: logger("Transitioned to state " + self.current_state)
-            else:
-                self.halted = True
-                if verbose: 
-                    print("No transitions found for this symbol. Halted.")
-                    if logger: logger("No transitions found for this symbol. Halted.")
+            self.current_state = compiled.state_names[compiled.next_state[state]]
+            self.log(EVENT_TRANSITION, (self.current_state,), verbose, logger)
 
-        elif instruction == "SCAN LEFT":
-            # Move the tape head left
-            self.input_tape.move("L")
-            symbol_buffer = self.input_tape.read()
-            if verbose: 
-                print("Read symbol " + symbol_buffer + " from the left")
-                if logger: logger("Read symbol " + symbol_buffer + " from the left")
-
-            # Transition to the next state based on symbol read
-            if symbol_buffer in transitions.keys():
-                self.current_state = transitions[symbol_buffer]
-                if verbose: 
-                    print("Transitioned to state " + self.current_state)
-                    if logger: logger("Transitioned to state " + self.current_state)
+        elif opcode in (OP_RIGHT, OP_LEFT):
+            tape = self.memory[associated_data]
+            if opcode == OP_RIGHT:
+                tape.move("R")
+                symbol_buffer = tape.read()
+                self.log(EVENT_READ_RIGHT, (symbol_buffer,), verbose, logger)
             else:
-                self.halted = True
-                if verbose: 
-                    print("No transitions found for this symbol. Halted.")
-                    if logger: logger("No transitions found for this symbol. Halted.")
-                
-        elif instruction == "RIGHT":
-            # Assert that the symbol buffer is not empty and associated data is a tape
-            if not isinstance(self.memory[associated_data], Tape):
-                raise Exception("Associated data must be a tape")
-            # Move the tape head right
-            self.memory[associated_data].move("R")
-            # Read
-            symbol_buffer = self.memory[associated_data].read()
-            if verbose: 
-                print("Read symbol " + symbol_buffer + " from the right")
-                if logger: logger("Read symbol " + symbol_buffer + " from the right")
+                tape.move("L")
+                symbol_buffer = tape.read()
+                self.log(EVENT_READ_LEFT, (symbol_buffer,), verbose, logger)
 
             # Find this symbol in the available transitions
-            keys = list(map(lambda x: (x.split("/")[0], x.split("/")[1]), transitions.keys()))
-            keys = list(filter(lambda x: x[0] == symbol_buffer, keys))
-            if len(keys) > 1:
+            code = compiled.symbol_codes.get(symbol_buffer, compiled.unknown_code)
+            next_state = compiled.table[state][code]
+            if next_state == NONDETERMINISTIC:
                 raise Exception("More than one transition for a symbol. Non-determinism is not supported.")
-            elif len(keys) == 0:
+            elif next_state == NO_TRANSITION:
                 self.halted = True
+                self.halt_reason = "no_transition"
                 raise Exception("No transitions found for this symbol. Halted.")
-            
-            # Replace the symbol in the tape with the symbol in the transition
-            if len(keys[0]) > 1:
-                # Get the transition and go to next state
-                self.current_state = transitions[str(keys[0][0]) + "/" + str(keys[0][1])]
-                self.memory[associated_data].write(keys[0][1])
-                if verbose: 
-                    print("Replaced symbol " + symbol_buffer + " with " + keys[0][1])
-                    if logger: logger("Replaced symbol " + symbol_buffer + " with " + keys[0][1])
-                if verbose: 
-                    print("Transitioning to state " + self.current_state)
-                    if logger: logger("Transitioning to state " + self.current_state)
-            else:
-                # Get the transition and go to next state
-                self.current_state = transitions[keys[0][0]]
-                if verbose: 
-                    print("Transitioning to state " + self.current_state)
-                    if logger: logger("Transitioning to state " + self.current_state)
-
-        elif instruction == "LEFT":
-            # Assert that the symbol buffer is not empty and associated data is a tape
-            if not isinstance(self.memory[associated_data], Tape):
-                raise Exception("Associated data must be a tape")
-            # Move the tape head left
-            self.memory[associated_data].move("L")
-            # Read
-            symbol_buffer = self.memory[associated_data].read()
-            if verbose: 
-                print("Read symbol " + symbol_buffer + " from the left")
-                if logger: logger("Read symbol " + symbol_buffer + " from the left")
-            # Find this symbol in the available transitions
-            keys = list(map(lambda x: (x.split("/")[0], x.split("/")[1]), transitions.keys()))
-            keys = list(filter(lambda x: x[0] == symbol_buffer, keys))
-            if len(keys) > 1:
-                raise Exception("More than one transition for a symbol. Non-determinism is not supported.")
-            
-            # Replace the symbol in the tape with the symbol in the transition
-            if len(keys[0]) > 1:
-                # Get the transition and go to next state
-                self.current_state = transitions[str(keys[0][0]) + "/" + str(keys[0][1])]
-                self.memory[associated_data].write(keys[0][1])
-                if verbose: 
-                    print("Replaced symbol " + symbol_buffer + " with " + keys[0][1])
-                    if logger: logger("Replaced symbol " + symbol_buffer + " with " + keys[0][1])
-                if verbose: 
-                    print("Transitioning to state " + self.current_state)
-                    if logger: logger("Transitioning to state " + self.current_state)
-            else:
-                # Get the transition and go to next state
-                self.current_state = transitions[keys[0][0]]
-                if verbose: 
-                    print("Transitioning to state " + self.current_state)
-                    if logger: logger("Transitioning to state " + self.current_state)
 
+            # Replace the symbol in the tape with the symbol in the transition and go to next state
+            self.current_state = compiled.state_names[next_state]
+            tape.write(compiled.writes[state][code])
+            self.log(EVENT_REPLACE, (symbol_buffer, compiled.writes[state][code]), verbose, logger)
+            self.log(EVENT_TRANSITIONING, (self.current_state,), verbose, logger)
+
+    def transition(self, state, symbol_buffer, verbose, logger):
+        # Transition to the next state based on the symbol buffer
+        compiled = self.compiled
+        next_state = compiled.table[state][compiled.symbol_codes.get(symbol_buffer, compiled.unknown_code)]
+        if next_state != NO_TRANSITION:
+            self.current_state = compiled.state_names[next_state]
+            self.log(EVENT_TRANSITION, (self.current_state,), verbose, logger)
         else:
-            raise Exception("Instruction not supported.")
-        
-    def run(self, verbose=False, logger=None):
-        """Runs the machine until it halts"""
+            self.halted = True
+            self.halt_reason = "no_transition"
+            self.log(EVENT_NO_TRANSITION, (), verbose, logger)
+
+    def execute(self, max_steps=None):
+        """Runs the compiled transition tables without tracing. Returns the number of instructions executed."""
+        if self.input_tape == None:
+            raise Exception("Input tape not set")
+        if self.halted:
+            return 0
+
+        compiled = self.compiled
+        if self.current_state == None:
+            if compiled.start_state == None:
+                raise Exception("Machine has no states")
+            state = compiled.start_state
+        else:
+            state = compiled.state_ids[self.current_state]
+
+        # Hoist everything the loop touches into locals
+        opcodes = compiled.opcodes
+        terminal = compiled.terminal
+        data = compiled.data
+        table = compiled.table
+        writes = compiled.writes
+        next_state = compiled.next_state
+        emit = compiled.emit
+        codes = compiled.symbol_codes.get
+        unknown = compiled.unknown_code
+        input_tape = self.input_tape
+        scan_right = input_tape.scan_right
+        output = self.output
+        # With a sink the loop appends to its buffer and flushes it when full
+        flush_size = -1
+        if self.output_sink != None:
+            output = self.output_sink.buffer
+            flush_size = self.output_sink.flush_size
+            flush = self.output_sink.flush
+        memory = [self.memory[key] for key in compiled.memory_keys]
+        readers = [m.pop if isinstance(m, Stack) else m.dequeue if isinstance(m, Queue) else None for m in memory]
+        writers = [m.push if isinstance(m, Stack) else m.enqueue if isinstance(m, Queue) else None for m in memory]
+        budget = -1 if max_steps == None else max_steps
+
+        steps = 0
+        try:
+            while True:
+                flag = terminal[state]
+                if flag:
+                    self.halted = True
+                    self.accepted = flag == ACCEPT
+                    self.halt_reason = terminal_halt_reasons[flag]
+                    break
+                if steps == budget:
+                    break
+                steps += 1
+
+                opcode = opcodes[state]
+                if opcode <= OP_SCAN_RIGHT:
+                    target = table[state][codes(scan_right(), unknown)]
+                elif opcode == OP_READ:
+                    target = table[state][codes(readers[data[state]](), unknown)]
+                elif opcode == OP_WRITE:
+                    writers[data[state]](emit[state])
+                    target = next_state[state]
+                elif opcode == OP_PRINT:
+                    output.append(emit[state])
+                    if len(output) == flush_size:
+                        flush()
+                    target = next_state[state]
+                elif opcode == OP_SCAN_LEFT:
+                    target = table[state][codes(input_tape.scan_left(), unknown)]
+                elif opcode == OP_ERROR:
+                    raise Exception(compiled.errors[state])
+                else:
+                    tape = memory[data[state]]
+                    code = codes(tape.scan_right() if opcode == OP_RIGHT else tape.scan_left(), unknown)
+                    target = table[state][code]
+                    if target == NONDETERMINISTIC:
+                        raise Exception("More than one transition for a symbol. Non-determinism is not supported.")
+                    elif target == NO_TRANSITION:
+                        self.halted = True
+                        self.halt_reason = "no_transition"
+                        raise Exception("No transitions found for this symbol. Halted.")
+                    tape.write(writes[state][code])
+
+                if target == NO_TRANSITION:
+                    self.halted = True
+                    self.halt_reason = "no_transition"
+                    break
+                state = target
+        finally:
+            self.current_state = compiled.state_names[state]
+            self.steps += steps
+            if self.halted and self.output_sink != None:
+                self.output_sink.flush()
+
+        return steps
+
+    def halt_looping(self):
+        self.halted = True
+        self.halt_reason = "looping"
+
+    def run_fast(self, max_steps=None, timeout=None, detect_loops=False) -> RunResult:
+        """Runs without tracing until the machine halts, max_steps instructions have run or timeout seconds have passed.
+
+        With detect_loops, a machine that repeats a configuration halts with the looping
+        halt reason instead of running out its budget.
+        """
+        remaining = max_steps
+        if timeout == None and not detect_loops:
+            self.execute(max_steps)
+            remaining = 0
+        else:
+            # Check the clock and the loop detector between fixed quanta so the inner loop stays untouched
+            deadline = None if timeout == None else time.monotonic() + timeout
+            interval = LOOP_CHECK_INTERVAL if detect_loops else DEADLINE_CHECK_INTERVAL
+            detector = LoopDetector(self) if detect_loops else None
+            while not self.halted and remaining != 0 and (deadline == None or time.monotonic() < deadline):
+                quantum = interval if remaining == None else min(remaining, interval)
+                executed = self.execute(quantum)
+                if remaining != None:
+                    remaining -= executed
+                if detector != None and not self.halted and detector.check():
+                    self.halt_looping()
+
+        halt_reason = self.halt_reason
+        if not self.halted:
+            halt_reason = "max_steps" if remaining == 0 else "timeout"
+        return RunResult(self.accepted, halt_reason, self.steps, self.flush_output())
+
+    def run(self, verbose=False, logger=None, detect_loops=False):
+        """Runs the machine until it halts, or until it repeats a configuration with detect_loops"""
+        if not verbose:
+            if detect_loops:
+                self.run_fast(detect_loops=True)
+            else:
+                self.execute()
+            return
+
+        detector = LoopDetector(self) if detect_loops else None
         while not self.halted:
-            self.step(verbose=verbose, logger=logger)
\ No newline at end of file
+            self.step(verbose=verbose, logger=logger)
+            if detector != None and not self.halted and detector.check():
+                self.halt_looping()
+                self.log(EVENT_LOOP, (), verbose, logger)
+
+    def iter_batch(self, inputs, is_turing_machine=False, max_steps=None, timeout=None, detect_loops=False):
+        """Runs every input tape on this machine in turn, yielding a RunResult per input"""
+        for input_tape in inputs:
+            self.reset()
+            try:
+                self.set_input_tape(input_tape, is_turing_machine=is_turing_machine)
+                yield self.run_fast(max_steps=max_steps, timeout=timeout, detect_loops=detect_loops)
+            except Exception as e:
+                # Tape machines halt by raising when no transition matches
+                halt_reason = self.halt_reason if self.halted else "error"
+                yield RunResult(False, halt_reason, self.steps, self.flush_output(), error=str(e))
+
+    def run_batch(self, inputs, is_turing_machine=False, max_steps=None, timeout=None, detect_loops=False):
+        """Runs every input tape on this machine and returns the list of RunResults in input order"""
+        return list(self.iter_batch(inputs, is_turing_machine=is_turing_machine, max_steps=max_steps, timeout=timeout, detect_loops=detect_loops))
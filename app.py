@@ -8,16 +8,19 @@
 """
 
 # Dependency Imports
-import sys, os, time
-from threading import Thread
+import sys, time
+from threading import Event
 from PyQt6.QtWidgets import QApplication, QLabel, QWidget, QGridLayout, QPlainTextEdit, QLineEdit, QGroupBox, QFormLayout, QPushButton, QLayout, QCheckBox
-from PyQt6.QtGui import QPixmap, QFontDatabase
+from PyQt6.QtGui import QPixmap, QImage, QFontDatabase, QTextCursor
 from PyQt6 import QtCore
 
 # Module Imports
 from input_parser import InputParser
 from abstract_simulator import AbstractMachineSimulator
-from abstract_grapher import graph_abstract_machine
+from aux_data_structures import Stack, Queue
+from machine_history import MachineHistory, PrefixCache
+from event_log import EventSink, EVENT_MESSAGE
+from abstract_grapher import cached_machine_graph
 
 # Main App
 app = QApplication(sys.argv)
@@ -32,59 +35,300 @@ def log(message):
     output_console.appendPlainText(message)
 
 machine_instance = None
+history = None
+# Configurations of earlier runs of the compiled machine, for resuming on an edited input tape
+prefix_cache = PrefixCache()
+# The input tape of the last compile; compiling again with the same one starts over
+compiled_input = None
+parser = None
+machine_graph_renderer = None
 
-def update_memory_inspector():
-    global machine_instance
-    global memory_inspector
-    try:
-        memory_inspector.clear()
+def show_machine_graph(current_state=None):
+    # The graph is laid out once per machine; stepping only recolours the current state
+    image = machine_graph_renderer.render_rgba(current_state)
+    qimage = QImage(image.tobytes(), image.shape[1], image.shape[0], image.shape[1] * 4, QImage.Format.Format_RGBA8888)
+    machine_graph.setPixmap(QPixmap.fromImage(qimage).scaled(600, 600, aspectRatioMode=QtCore.Qt.AspectRatioMode.KeepAspectRatio, transformMode=QtCore.Qt.TransformationMode.SmoothTransformation))
+
+# The memory inspector shows this many cells on each side of a tape head, this many
+# entries of a stack or queue and this many symbols of output, whatever their size
+INSPECTOR_TAPE_RADIUS = 40
+INSPECTOR_ITEMS = 32
+INSPECTOR_OUTPUT = 200
+
+def format_memory(memory):
+    if isinstance(memory, Stack):
+        # The top of the stack, with the entries below it counted
+        items = memory.top_items(INSPECTOR_ITEMS)
+        retstring = str(items)
+        if len(memory) > len(items):
+            retstring = "[... " + str(len(memory) - len(items)) + " more, " + retstring[1:]
+        return retstring
+    elif isinstance(memory, Queue):
+        # The front of the queue, with the entries behind it counted
+        items = memory.first(INSPECTOR_ITEMS)
+        retstring = str(items)
+        if len(memory) > len(items):
+            retstring = retstring[:-1] + ", ... " + str(len(memory) - len(items)) + " more]"
+        return retstring
+    return memory.window(INSPECTOR_TAPE_RADIUS)[0]
+
+def machine_snapshot(machine):
+    # Formats the memory inspector text; workers call this between quanta, off the GUI thread
+    lines = []
+
+    # Input Tape, around the head
+    tape, column = machine.input_tape.window(INSPECTOR_TAPE_RADIUS)
+    lines.append("Input Tape: " + tape)
+    lines.append("Tape Head:  " + (" " * column if column != None else " ") + "^")
+    lines.append("")
 
-        # Input Tape
-        memory_inspector.appendPlainText("Input Tape: " + str(machine_instance.input_tape))
-        memory_inspector.appendPlainText("Tape Head:  " + str(" " * machine_instance.input_tape.head) + " ^")
-        memory_inspector.appendPlainText("")
+    # Display current state
+    lines.append("Current State: " + str(machine.current_state or next(iter(machine.state_map))))
+    lines.append("")
 
-        # Display current state
-        memory_inspector.appendPlainText("Current State: " + str(machine_instance.current_state or list(machine_instance.state_map.keys())[0]))
-        memory_inspector.appendPlainText("")
+    if len(machine.memory.keys()) < 1:
+        lines.append("No auxiliary memory used.")
+    for key in machine.memory.keys():
+        lines.append(str(machine.aux_data[key]["type"]) + " " + key + ": " + format_memory(machine.memory[key]))
 
-        if len(machine_instance.memory.keys()) < 1:
-            memory_inspector.appendPlainText("No auxiliary memory used.")
-        for key in machine_instance.memory.keys():
-            memory_inspector.appendPlainText(str(machine_instance.aux_data[key]["type"]) + " " + key + ": " + str(machine_instance.memory[key]))
+    lines.append("")
 
-        memory_inspector.appendPlainText("")
+    # Output Tape, its last symbols only
+    out = machine.output_tail(INSPECTOR_OUTPUT)
+    if len(machine.output) > INSPECTOR_OUTPUT:
+        out = "..." + out
+    lines.append("Output Buffer: " + out)
+    lines.append("")
 
-        # Output Tape
-        out = "".join(machine_instance.output)
-        memory_inspector.appendPlainText("Output Buffer: " + out)
-        memory_inspector.appendPlainText("")
+    # Machine States
+    lines.append("Halted State: " + str(machine.halted))
+    lines.append("Accept State: " + str(machine.accepted))
+    if machine.steps > 0:
+        lines.append("Steps: " + str(machine.steps))
 
-        # Machine States
-        memory_inspector.appendPlainText("Halted State: " + str(machine_instance.halted))
-        memory_inspector.appendPlainText("Accept State: " + str(machine_instance.accepted))
+    return {"text": "\n".join(lines), "current_state": machine.current_state}
+
+inspector_lines = []
+
+def show_inspector_text(text):
+    # Only the lines that changed since the last snapshot are replaced in the widget
+    global inspector_lines
+    lines = text.split("\n")
+    if len(lines) != len(inspector_lines):
+        memory_inspector.setPlainText(text)
+    else:
+        document = memory_inspector.document()
+        for i in range(len(lines)):
+            if lines[i] != inspector_lines[i]:
+                cursor = QTextCursor(document.findBlockByNumber(i))
+                cursor.movePosition(QTextCursor.MoveOperation.EndOfBlock, QTextCursor.MoveMode.KeepAnchor)
+                cursor.insertText(lines[i])
+    inspector_lines = lines
+
+def show_snapshot(snapshot):
+    try:
+        show_inspector_text(snapshot["text"])
 
         # Update the machine graph
-        graph_abstract_machine(machine_instance.logic, machine_instance.current_state)
-        machine_graph.setPixmap(QPixmap("./graph_abstract_machine.png").scaled(600, 600, aspectRatioMode=QtCore.Qt.AspectRatioMode.KeepAspectRatio, transformMode=QtCore.Qt.TransformationMode.SmoothTransformation))
-        os.remove("./graph_abstract_machine.png")
-        
+        show_machine_graph(snapshot["current_state"])
+
+    except Exception as e:
+        log("Error: " + str(e))
+
+def update_memory_inspector():
+    global machine_instance
+    try:
+        show_snapshot(machine_snapshot(machine_instance))
     except Exception as e:
         log("Error: " + str(e))
 
+# Background execution
+REFRESH_INTERVAL = 0.1
+QUANTUM_DURATION = 0.02
+MAX_QUANTUM = 1 << 20
+# The console keeps at most this many lines, and a run posts at most this many per refresh
+CONSOLE_MAX_LINES = 5000
+
+class MachineWorker(QtCore.QObject):
+    """Runs the machine on a QThread in quanta of steps"""
+    progress = QtCore.pyqtSignal(object)
+    logged = QtCore.pyqtSignal(list)
+    finished = QtCore.pyqtSignal(str)
+
+    def __init__(self, history, verbose=False, delay=0):
+        super().__init__()
+        # Steps go through the history so that it keeps taking checkpoints
+        self.history = history
+        self.machine = history.machine
+        self.verbose = verbose
+        self.delay = delay
+        # Only the verbose events still in the bounded sink get formatted when a batch is posted
+        self.events = EventSink(capacity=CONSOLE_MAX_LINES)
+        self.cancelled = Event()
+        self.running = Event()
+        self.running.set()
+
+    def pause(self):
+        self.running.clear()
+
+    def resume(self):
+        self.running.set()
+
+    def cancel(self):
+        self.cancelled.set()
+        self.running.set()
+
+    def is_paused(self):
+        return not self.running.is_set()
+
+    def run(self):
+        machine = self.machine
+        history = self.history
+        quantum = 1 if self.delay > 0 else 1024
+        events = self.events
+        machine.event_sink = events
+        last_update = time.monotonic()
+        result = "Machine ran successfully."
+        try:
+            while not machine.halted and not self.cancelled.is_set():
+                if not self.running.is_set():
+                    # Show where the machine stopped, then wait for resume or cancel
+                    self.post()
+                    self.running.wait()
+                    continue
+
+                started = time.monotonic()
+                if self.verbose or self.delay > 0:
+                    for _ in range(quantum):
+                        if machine.halted:
+                            break
+                        history.step(verbose=self.verbose)
+                        if self.delay > 0:
+                            events.emit(EVENT_MESSAGE, ("Machine stepped successfully.",))
+                else:
+                    history.execute(max_steps=quantum)
+                now = time.monotonic()
+
+                # Quanta grow until they take about QUANTUM_DURATION, so pause and cancel stay quick
+                if self.delay == 0 and now - started < QUANTUM_DURATION and quantum < MAX_QUANTUM:
+                    quantum *= 2
+                if self.delay > 0 or now - last_update >= REFRESH_INTERVAL:
+                    self.post()
+                    last_update = now
+                if self.delay > 0:
+                    self.cancelled.wait(self.delay)
+
+            if self.cancelled.is_set() and not machine.halted:
+                result = "Machine cancelled after " + str(machine.steps) + " steps."
+        except Exception as e:
+            result = "Error: " + str(e)
+        finally:
+            machine.event_sink = None
+            # The last snapshot goes out before the run is reported finished
+            self.post()
+            self.finished.emit(result)
+
+    def post(self):
+        messages = self.events.drain()
+        if len(messages) > 0:
+            self.logged.emit(messages)
+        self.progress.emit(machine_snapshot(self.machine))
+
+worker = None
+worker_thread = None
+
+def log_messages(messages):
+    output_console.appendPlainText("\n".join(messages))
+
+def worker_finished(message):
+    global worker
+    log(message)
+    worker = None
+    set_running(False)
+
+def set_running(running):
+    btn_step_machine.setDisabled(running)
+    btn_step_back.setDisabled(running)
+    btn_slow_run.setDisabled(running)
+    btn_run_machine.setDisabled(running)
+    btn_pause_machine.setDisabled(not running)
+    btn_cancel_machine.setDisabled(not running)
+    btn_pause_machine.setText("Pause Machine")
+
+def start_worker(delay=0):
+    global worker
+    global worker_thread
+    worker_thread = QtCore.QThread()
+    worker = MachineWorker(history, verbose=verbose_checkbox.isChecked(), delay=delay)
+    worker.moveToThread(worker_thread)
+    worker_thread.started.connect(worker.run)
+    worker.progress.connect(from_current_worker(worker, show_snapshot))
+    worker.logged.connect(from_current_worker(worker, log_messages))
+    worker.finished.connect(from_current_worker(worker, worker_finished))
+    worker.finished.connect(worker_thread.quit)
+    set_running(True)
+    worker_thread.start()
+
+def from_current_worker(source, slot):
+    # Signals a stopped worker had already queued are dropped once another run or compile took over
+    def receive(*arguments):
+        if source is worker:
+            slot(*arguments)
+    return receive
+
+def stop_worker():
+    # Cancels a running worker and waits for its thread, so the machine can be used again
+    global worker
+    if worker != None:
+        worker.cancel()
+    if worker_thread != None:
+        worker_thread.quit()
+        worker_thread.wait()
+    if worker != None:
+        worker = None
+        set_running(False)
+
+def pause_machine():
+    if worker == None:
+        return
+    if worker.is_paused():
+        worker.resume()
+        btn_pause_machine.setText("Pause Machine")
+    else:
+        worker.pause()
+        btn_pause_machine.setText("Resume Machine")
+
+def cancel_machine():
+    if worker != None:
+        worker.cancel()
+
 def compile_machine():
     global machine_instance
+    global history
+    global parser
+    global machine_graph_renderer
+    global compiled_input
+
+    stop_worker()
 
     # Clear the output log
     output_console.clear()
 
     try:
-        parser = InputParser(machine_description.toPlainText())
-        machine_instance = AbstractMachineSimulator(parser.parse())
-        graph_abstract_machine(machine_instance.logic)
-        machine_graph.setPixmap(QPixmap("./graph_abstract_machine.png").scaled(600, 600, aspectRatioMode=QtCore.Qt.AspectRatioMode.KeepAspectRatio, transformMode=QtCore.Qt.TransformationMode.SmoothTransformation))
-        os.remove("./graph_abstract_machine.png")
+        if parser == None or machine_instance == None:
+            parser = InputParser(machine_description.toPlainText())
+            machine_instance = AbstractMachineSimulator(parser.parse())
+            prefix_cache.clear()
+        else:
+            # Only the edited lines are parsed and compiled again
+            aux_data_changes, logic_changes = parser.update(machine_description.toPlainText())
+            if len(aux_data_changes) > 0 or len(logic_changes) > 0:
+                prefix_cache.clear()
+            machine_instance.apply_changes(aux_data_changes, logic_changes)
+        machine_graph_renderer = cached_machine_graph(machine_instance.logic)
+        show_machine_graph()
         btn_step_machine.setDisabled(False)
+        btn_step_back.setDisabled(False)
         btn_slow_run.setDisabled(False)
         btn_run_machine.setDisabled(False)
         log("Machine Compiled Successfully.")
@@ -95,10 +339,21 @@ def compile_machine():
             if machine_instance.aux_data[key]["type"] == "TAPE":
                 is_turing_machine = True
                 break
-        machine_instance.set_input_tape(input_tape.text(), is_turing_machine=is_turing_machine)
+        # A run on an edited input sharing a prefix with an earlier one starts where that prefix was read
+        resumed = []
+        if input_tape.text() != compiled_input:
+            resumed = prefix_cache.resume(machine_instance, input_tape.text(), is_turing_machine=is_turing_machine)
+        else:
+            machine_instance.set_input_tape(input_tape.text(), is_turing_machine=is_turing_machine)
+        compiled_input = input_tape.text()
         if is_turing_machine: log("Turing machine detected. Input tape set to first aux memory tape.")
 
         log("Using input tape: " + str(machine_instance.input_tape))
+        if len(resumed) > 0:
+            log("Resumed at step " + str(machine_instance.steps) + " from an earlier run on the same first " + str(machine_instance.input_tape.head) + " input symbols.")
+
+        # Checkpoints of this run, for stepping back
+        history = MachineHistory(machine_instance, prefix_cache=prefix_cache, checkpoints=resumed)
 
         update_memory_inspector()
 
@@ -113,12 +368,25 @@ def step_machine():
             log("Machine is halted.")
             return
 
-        machine_instance.step(verbose=verbose_checkbox.isChecked(), logger=log)
+        history.step(verbose=verbose_checkbox.isChecked(), logger=log)
         log("Machine stepped successfully.")
         update_memory_inspector()
     except Exception as e:
         log("Error: " + str(e))
 
+def step_back_machine():
+    try:
+        if machine_instance.steps == 0:
+            log("Machine is at the first step.")
+            return
+
+        # Restores the nearest checkpoint and replays up to the previous step
+        history.step_back()
+        log("Stepped back to step " + str(machine_instance.steps) + ".")
+        update_memory_inspector()
+    except Exception as e:
+        log("Error: " + str(e))
+
 def run_machine():
     global machine_instance
     try:
@@ -126,23 +394,22 @@ def run_machine():
         if machine_instance.halted:
             log("Machine is halted.")
             return
-        
-        machine_instance.run(verbose=verbose_checkbox.isChecked(), logger=log)
-        log("Machine ran successfully.")
-        update_memory_inspector()
+
+        # Run on a worker thread so the window stays responsive
+        start_worker()
     except Exception as e:
         log("Error: " + str(e))
 
 def slow_run_machine():
     global machine_instance
-    global step_machine
     try:
-        # Run the "step_machine" function in a separate thread
-        def run():
-            while not machine_instance.halted:
-                step_machine()
-                time.sleep(0.5)
-        Thread(target=run).start()
+        # Check if machine is halted
+        if machine_instance.halted:
+            log("Machine is halted.")
+            return
+
+        # Step every half second on a worker thread
+        start_worker(delay=0.5)
     except Exception as e:
         log("Error: " + str(e))
 
@@ -170,20 +437,32 @@ btn_compile_machine = QPushButton("Compile / Reset Machine")
 btn_compile_machine.clicked.connect(compile_machine)
 btn_step_machine = QPushButton("Step Machine")
 btn_step_machine.clicked.connect(step_machine)
+btn_step_back = QPushButton("Step Back")
+btn_step_back.clicked.connect(step_back_machine)
 btn_slow_run = QPushButton("Slowly Run Machine")
 btn_slow_run.clicked.connect(slow_run_machine)
 btn_run_machine = QPushButton("Run Machine")
 btn_run_machine.clicked.connect(run_machine)
+btn_pause_machine = QPushButton("Pause Machine")
+btn_pause_machine.clicked.connect(pause_machine)
+btn_cancel_machine = QPushButton("Cancel Run")
+btn_cancel_machine.clicked.connect(cancel_machine)
 btn_step_machine.setDisabled(True)
+btn_step_back.setDisabled(True)
 btn_slow_run.setDisabled(True)
 btn_run_machine.setDisabled(True)
+btn_pause_machine.setDisabled(True)
+btn_cancel_machine.setDisabled(True)
 execution_panel_layout = QFormLayout()
 execution_panel_layout.addRow(QLabel("Input Tape:"), input_tape)
 execution_panel_layout.addRow(verbose_checkbox)
 execution_panel_layout.addRow(btn_compile_machine)
 execution_panel_layout.addRow(btn_step_machine)
+execution_panel_layout.addRow(btn_step_back)
 execution_panel_layout.addRow(btn_slow_run)
 execution_panel_layout.addRow(btn_run_machine)
+execution_panel_layout.addRow(btn_pause_machine)
+execution_panel_layout.addRow(btn_cancel_machine)
 execution_panel_layout.setSizeConstraint(QLayout.SizeConstraint.SetNoConstraint)
 execution_panel.setLayout(execution_panel_layout)
 machine_graph = QLabel()
@@ -192,6 +471,7 @@ output_console = QPlainTextEdit()
 output_console.setReadOnly(True)
 output_console.setLineWrapMode(QPlainTextEdit.LineWrapMode.NoWrap)
 output_console.setFont(monospaced_font)
+output_console.setMaximumBlockCount(CONSOLE_MAX_LINES)
 output_console.setPlainText("""Abstract Machine Interpreter by Adriel Isaiah Amoguis (v1)
 Compile a machine to get started.""")
 memory_inspector = QPlainTextEdit()
@@ -218,4 +498,6 @@ window.setLayout(layout)
 window.show()
 
 # Run Event Loop
-sys.exit(app.exec())
\ No newline at end of file
+exit_code = app.exec()
+stop_worker()
+sys.exit(exit_code)
\ No newline at end of file
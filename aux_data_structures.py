@@ -1,62 +1,259 @@
+import io, codecs
+from array import array
+
+# Symbols held by tapes, stacks and queues are interned to integer codes; # is always code 0
+symbol_table = ["#"]
+symbol_codes = {"#": 0}
+
+# Stacks and queues reconsider run-length encoding once they hold this many elements, then
+# each time they double; RLE is used while runs are at least this long on average
+RLE_CHECK_SIZE = 1024
+RLE_MIN_RUN = 4
+
+# Polynomial hashing of contents for loop detection, modulo the Mersenne prime 2^61 - 1
+FINGERPRINT_MODULUS = (1 << 61) - 1
+FINGERPRINT_BASE = 1000003
+FINGERPRINT_INVERSE = pow(FINGERPRINT_BASE, -1, FINGERPRINT_MODULUS)
+
+def run_length_encode(items, counts=None):
+    # Merges equal neighbouring codes into (codes, run lengths) arrays
+    codes = array("I")
+    lengths = array("Q")
+    for i in range(len(items)):
+        count = 1 if counts == None else counts[i]
+        if len(codes) > 0 and codes[-1] == items[i]:
+            lengths[-1] += count
+        else:
+            codes.append(items[i])
+            lengths.append(count)
+    return codes, lengths
+
+def run_length_decode(codes, lengths):
+    items = array("I")
+    for i in range(len(codes)):
+        items.extend(array("I", [codes[i]]) * lengths[i])
+    return items
+
+def intern_symbol(symbol):
+    code = symbol_codes.get(symbol)
+    if code == None:
+        code = len(symbol_table)
+        symbol_codes[symbol] = code
+        symbol_table.append(symbol)
+    return code
+
 class Stack:
+    """Stack of interned symbol codes that switches to run-length encoding when it pays off.
+
+    Flat mode keeps one code per element. RLE mode keeps parallel arrays of run codes and
+    run lengths, so pushing the same symbol n times takes O(1) memory. The representation
+    is chosen each time the stack grows past twice the size of the last check.
+    """
+    __slots__ = ("items", "counts", "size", "next_check")
+
     def __init__(self):
-        self.stack = []
-        self.top = -1
+        self.items = array("I")
+        # Run lengths in RLE mode, None in flat mode
+        self.counts = None
+        self.size = 0
+        self.next_check = RLE_CHECK_SIZE
 
     def push(self, value):
-        self.stack.append(value)
-        self.top += 1
+        code = symbol_codes.get(value)
+        if code == None:
+            code = intern_symbol(value)
+        items = self.items
+        counts = self.counts
+        if counts == None:
+            items.append(code)
+        elif len(items) > 0 and items[-1] == code:
+            counts[-1] += 1
+        else:
+            items.append(code)
+            counts.append(1)
+        self.size += 1
+        if self.size >= self.next_check:
+            self.choose_representation()
 
     def pop(self):
-        if self.top == -1:
+        if self.size == 0:
             return None
-        else:
-            self.top -= 1
-            return self.stack.pop()
+        self.size -= 1
+        counts = self.counts
+        if counts == None:
+            return symbol_table[self.items.pop()]
+        if counts[-1] == 1:
+            counts.pop()
+            return symbol_table[self.items.pop()]
+        counts[-1] -= 1
+        return symbol_table[self.items[-1]]
 
     def peek(self):
-        if self.top == -1:
+        if self.size == 0:
             return None
         else:
-            return self.stack[self.top]
+            return symbol_table[self.items[-1]]
+
+    def choose_representation(self):
+        self.next_check = max(RLE_CHECK_SIZE, 2 * self.size)
+        runs = run_length_encode(self.items, self.counts)
+        if self.counts == None and len(runs[0]) * RLE_MIN_RUN <= self.size:
+            self.items, self.counts = runs
+        elif self.counts != None and len(runs[0]) * RLE_MIN_RUN > 2 * self.size:
+            self.items = run_length_decode(self.items, self.counts)
+            self.counts = None
 
     def get_stack(self):
-        return self.stack
+        if self.counts == None:
+            return [symbol_table[code] for code in self.items]
+        return [symbol_table[code] for code in run_length_decode(self.items, self.counts)]
+
+    @property
+    def top(self):
+        # Index of the top element, -1 when empty
+        return self.size - 1
+
+    def top_items(self, k):
+        """Returns up to k symbols from the top of the stack, bottom to top, without decoding the rest"""
+        items = self.items
+        if self.counts == None:
+            return [symbol_table[code] for code in items[max(0, len(items) - k):]]
+        symbols = []
+        i = len(items) - 1
+        while i >= 0 and len(symbols) < k:
+            symbols.extend([symbol_table[items[i]]] * min(self.counts[i], k - len(symbols)))
+            i -= 1
+        symbols.reverse()
+        return symbols
 
     def get_top(self):
-        return self.top
+        return self.size - 1
 
     def is_empty(self):
-        return self.top == -1
+        return self.size == 0
+
+    def is_run_length_encoded(self):
+        return self.counts != None
+
+    def __len__(self):
+        return self.size
 
     def __str__(self):
-        return str(self.stack)
+        return str(self.get_stack())
     
 class Queue:
+    """FIFO queue in ring buffers of interned symbol codes whose capacity is a power of two.
+
+    Like Stack, it switches between one slot per element and run-length encoded slots
+    (a parallel ring of run lengths) as it grows.
+    """
+    __slots__ = ("items", "counts", "start", "used", "size", "next_check", "front", "back")
+
     def __init__(self):
-        self.queue = []
+        self.items = array("I", bytes(4 * 16))
+        # Run lengths in RLE mode, None in flat mode
+        self.counts = None
+        self.start = 0
+        # Occupied slots, and elements held (equal in flat mode)
+        self.used = 0
+        self.size = 0
+        self.next_check = RLE_CHECK_SIZE
+        # Number of dequeues so far, and number of enqueues so far minus one
         self.front = 0
         self.back = -1
 
     def enqueue(self, value):
-        self.queue.append(value)
+        code = symbol_codes.get(value)
+        if code == None:
+            code = intern_symbol(value)
+        counts = self.counts
+        mask = len(self.items) - 1
+        last = (self.start + self.used - 1) & mask
+        if counts != None and self.used > 0 and self.items[last] == code:
+            counts[last] += 1
+        else:
+            if self.used == len(self.items):
+                self.resize(2 * len(self.items))
+                mask = len(self.items) - 1
+            self.items[(self.start + self.used) & mask] = code
+            if self.counts != None:
+                self.counts[(self.start + self.used) & mask] = 1
+            self.used += 1
+        self.size += 1
         self.back += 1
+        if self.size >= self.next_check:
+            self.choose_representation()
 
     def dequeue(self):
-        if self.front > self.back:
+        if self.size == 0:
             return None
+        start = self.start
+        code = self.items[start]
+        if self.counts != None and self.counts[start] > 1:
+            self.counts[start] -= 1
         else:
-            self.front += 1
-            return self.queue.pop(0)
+            self.start = (self.start + 1) & (len(self.items) - 1)
+            self.used -= 1
+        self.size -= 1
+        self.front += 1
+        return symbol_table[code]
 
     def peek(self):
-        if self.front > self.back:
+        if self.size == 0:
             return None
         else:
-            return self.queue[self.front]
+            return symbol_table[self.items[self.start]]
+
+    def slots(self):
+        # Occupied slots in queue order, as (codes, run lengths or None)
+        items = (self.items[self.start:] + self.items[:self.start])[:self.used]
+        if self.counts == None:
+            return items, None
+        return items, (self.counts[self.start:] + self.counts[:self.start])[:self.used]
+
+    def resize(self, capacity):
+        # Unroll the ring into a buffer of the given capacity
+        items, counts = self.slots()
+        self.load(items, counts, capacity)
+
+    def load(self, items, counts, capacity=16):
+        while capacity < len(items):
+            capacity *= 2
+        items.frombytes(bytes(4 * (capacity - len(items))))
+        if counts != None:
+            counts.frombytes(bytes(8 * (capacity - len(counts))))
+        self.items = items
+        self.counts = counts
+        self.start = 0
+
+    def choose_representation(self):
+        self.next_check = max(RLE_CHECK_SIZE, 2 * self.size)
+        items, counts = self.slots()
+        runs = run_length_encode(items, counts)
+        if counts == None and len(runs[0]) * RLE_MIN_RUN <= self.size:
+            self.used = len(runs[0])
+            self.load(runs[0], runs[1])
+        elif counts != None and len(runs[0]) * RLE_MIN_RUN > 2 * self.size:
+            self.used = self.size
+            self.load(run_length_decode(items, counts), None)
 
     def get_queue(self):
-        return self.queue
+        items, counts = self.slots()
+        if counts != None:
+            items = run_length_decode(items, counts)
+        return [symbol_table[code] for code in items]
+
+    def first(self, k):
+        """Returns up to k symbols from the front of the queue, front to back, without unrolling the ring"""
+        symbols = []
+        mask = len(self.items) - 1
+        slot = 0
+        while slot < self.used and len(symbols) < k:
+            index = (self.start + slot) & mask
+            count = 1 if self.counts == None else min(self.counts[index], k - len(symbols))
+            symbols.extend([symbol_table[self.items[index]]] * count)
+            slot += 1
+        return symbols
 
     def get_front(self):
         return self.front
@@ -65,27 +262,61 @@ class Queue:
         return self.back
 
     def is_empty(self):
-        return self.front > self.back
+        return self.size == 0
+
+    def is_run_length_encoded(self):
+        return self.counts != None
+
+    def __len__(self):
+        return self.size
 
     def __str__(self):
-        return str(self.queue)
+        return str(self.get_queue())
     
 class Tape:
+    """Two-way tape stored as an array of interned symbol codes.
+
+    Cells left..right exist (a fresh tape holds two blank # cells). The buffer grows by
+    doubling on either end, and moving right past the last cell creates blank cells like
+    the original dictionary-backed tape did, so head movement is O(1).
+    """
+    __slots__ = ("cells", "offset", "left", "right", "head")
+
     def __init__(self):
-        self.tape = {}
+        # cells[offset] is logical cell 0; unused capacity is blank (code 0)
+        self.cells = array("I", bytes(4 * 16))
+        self.offset = 0
+        self.left = 0
+        self.right = 1
         self.head = 0
 
-        self.tape[0] = "#"
-        self.tape[1] = "#"
+    def reserve(self, position):
+        # Grow the buffer so that logical cell position has storage
+        index = position + self.offset
+        if index < 0:
+            grow = max(len(self.cells), -index)
+            cells = array("I", bytes(4 * grow))
+            cells.extend(self.cells)
+            self.cells = cells
+            self.offset += grow
+        elif index >= len(self.cells):
+            self.cells.frombytes(bytes(4 * max(len(self.cells), index + 1 - len(self.cells))))
 
     def write(self, value):
-        self.tape[self.head] = value
+        head = self.head
+        if head < self.left:
+            self.reserve(head)
+            self.left = head
+        elif head > self.right:
+            self.reserve(head)
+            self.right = head
+        self.cells[head + self.offset] = intern_symbol(value)
 
     def read(self):
-        if self.head in self.tape:
-            return self.tape[self.head]
-        else:
+        head = self.head
+        if head < self.left or head > self.right:
             return None
+        return symbol_table[self.cells[head + self.offset]]
 
     def move(self, direction):
         if direction == "R":
@@ -96,30 +327,336 @@ class Tape:
             raise ValueError("Invalid direction: " + direction)
         
         # If we go past the rightmost cell, create a new cell
-        if self.head > max(self.tape.keys()):
-            self.tape[self.head] = "#"
-            self.tape[self.head+1] = "#"
+        if self.head > self.right:
+            self.reserve(self.head + 1)
+            self.right = self.head + 1
+
+    def scan_right(self):
+        # move("R") followed by read()
+        head = self.head = self.head + 1
+        if head > self.right:
+            self.reserve(head + 1)
+            self.right = head + 1
+        return symbol_table[self.cells[head + self.offset]]
+
+    def scan_left(self):
+        # move("L") followed by read()
+        head = self.head = self.head - 1
+        if head < self.left:
+            return None
+        return symbol_table[self.cells[head + self.offset]]
 
     def get_tape(self):
-        return self.tape
+        return {i: symbol_table[self.cells[i + self.offset]] for i in range(self.left, self.right + 1)}
 
     def get_head(self):
         return self.head
 
-    def __str__(self):
-        retstring = ""
+    def window(self, radius):
+        """Renders the cells within radius of the head like __str__, with ... for the cells left out.
 
-        for key in self.tape.keys():
-            if key == self.head:
-                retstring += "[" + self.tape[key] + "]"
-            else:
-                retstring += self.tape[key]
+        Returns the text and the column of the head symbol in it, or None when the head is
+        off the tape.
+        """
+        center = min(max(self.head, self.left), self.right)
+        start = max(self.left, center - radius)
+        end = min(self.right, center + radius)
+        cells = [symbol_table[code] for code in self.cells[start + self.offset:end + self.offset + 1]]
+        prefix = "..." if start > self.left else ""
+        suffix = "..." if end < self.right else ""
+        column = None
+        if self.left <= self.head <= self.right:
+            column = len(prefix) + len("".join(cells[:self.head - start])) + 1
+            cells[self.head - start] = "[" + cells[self.head - start] + "]"
+        return prefix + "".join(cells) + suffix, column
 
-        return retstring
+    def __str__(self):
+        cells = [symbol_table[code] for code in self.cells[self.left + self.offset:self.right + self.offset + 1]]
+        if self.left <= self.head <= self.right:
+            cells[self.head - self.left] = "[" + cells[self.head - self.left] + "]"
+        return "".join(cells)
     
 class InputTape(Tape):
+    __slots__ = ()
+
     def __init__(self, input_string):
         super().__init__()
-        for i in range(len(input_string)):
-            self.tape[i] = input_string[i]
-        self.head = 0
\ No newline at end of file
+        self.reserve(2 * len(input_string))
+        # Intern each distinct symbol once, then encode the whole string in one pass
+        for symbol in dict.fromkeys(input_string):
+            intern_symbol(symbol)
+        self.cells[:len(input_string)] = array("I", map(symbol_codes.__getitem__, input_string))
+        self.right = max(1, len(input_string) - 1)
+        self.head = 0
+
+class StreamingInputTape:
+    """Read-only input tape fed from an iterator of strings, a file object or an mmap.
+
+    The source supplies the symbols between the enclosing # sentinels. Only the current
+    chunk is kept in memory, so the head can only move right; once the source is exhausted
+    the tape reads # forever, like a Tape that runs off its right end.
+    """
+    def __init__(self, source, chunk_size=65536, encoding="utf-8"):
+        self.chunk_size = chunk_size
+        self.reader = source.read if hasattr(source, "read") else None
+        self.iterator = None if self.reader else iter(source)
+        self.decoder = codecs.getincrementaldecoder(encoding)()
+        self.exhausted = False
+
+        # The current chunk and the tape position of its first cell
+        self.chunk = "#"
+        self.chunk_start = 0
+        self.head = 0
+
+    def next_chunk(self):
+        while not self.exhausted:
+            if self.reader:
+                data = self.reader(self.chunk_size)
+                if not data:
+                    self.exhausted = True
+            else:
+                data = next(self.iterator, None)
+                if data == None:
+                    self.exhausted = True
+                    data = b""
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                data = self.decoder.decode(data, final=self.exhausted)
+            if data:
+                return data
+        return "#"
+
+    def read(self):
+        return self.chunk[self.head - self.chunk_start]
+
+    def scan_right(self):
+        self.move("R")
+        return self.chunk[self.head - self.chunk_start]
+
+    def scan_left(self):
+        self.move("L")
+
+    def write(self, value):
+        raise Exception("Streaming input tapes are read-only")
+
+    def move(self, direction):
+        if direction != "R":
+            raise Exception("Streaming input tapes can only move right")
+        self.head += 1
+        if self.head - self.chunk_start >= len(self.chunk):
+            self.chunk_start += len(self.chunk)
+            self.chunk = self.next_chunk()
+
+    def get_head(self):
+        return self.head
+
+    def window(self, radius):
+        """Renders the symbols within radius of the head, see Tape.window()"""
+        offset = self.head - self.chunk_start
+        start = max(0, offset - radius)
+        end = min(len(self.chunk), offset + radius + 1)
+        prefix = "..." if start > 0 or self.chunk_start > 0 else ""
+        suffix = "..." if end < len(self.chunk) or not self.exhausted else ""
+        text = prefix + self.chunk[start:offset] + "[" + self.chunk[offset] + "]" + self.chunk[offset + 1:end] + suffix
+        return text, len(prefix) + offset - start + 1
+
+    def __str__(self):
+        offset = self.head - self.chunk_start
+        retstring = "..." if self.chunk_start > 0 else ""
+        retstring += self.chunk[:offset] + "[" + self.chunk[offset] + "]" + self.chunk[offset + 1:]
+        if not self.exhausted:
+            retstring += "..."
+        return retstring
+
+class OutputSink:
+    """Destination for PRINT output that streams it out instead of keeping it in memory.
+
+    The target is a writable file object (text, or binary in which case the output is
+    encoded) or a callable that takes a string. Symbols are buffered and handed over once
+    flush_size of them are pending, so memory stays constant however long the output is.
+    The last tail_size symbols are kept for display.
+    """
+    def __init__(self, target, flush_size=65536, encoding="utf-8", tail_size=256):
+        if callable(target):
+            self.writer = target
+        elif hasattr(target, "write"):
+            binary = isinstance(target, (io.RawIOBase, io.BufferedIOBase)) or "b" in getattr(target, "mode", "")
+            self.writer = (lambda text: target.write(text.encode(encoding))) if binary else target.write
+        else:
+            raise Exception("Output sink must be a writable file or a callable")
+        self.target = target
+        self.flush_size = max(1, flush_size)
+        self.tail_size = tail_size
+        self.buffer = []
+        # Symbols already handed to the target, and the last tail_size of them
+        self.written = 0
+        self.recent = []
+
+    def append(self, symbol):
+        buffer = self.buffer
+        buffer.append(symbol)
+        if len(buffer) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        buffer = self.buffer
+        if len(buffer) == 0:
+            return
+        self.writer("".join(buffer))
+        self.written += len(buffer)
+        self.recent = (self.recent + buffer[-self.tail_size:])[-self.tail_size:]
+        # Cleared in place, the simulator's run loop appends to this list directly
+        del buffer[:]
+        if hasattr(self.target, "flush"):
+            self.target.flush()
+
+    def tail(self, count):
+        """Returns the last count symbols printed, up to tail_size of them"""
+        count = min(count, self.tail_size)
+        symbols = self.buffer[-count:] if count > 0 else []
+        if len(symbols) < count:
+            symbols = self.recent[max(0, len(self.recent) - (count - len(symbols))):] + symbols
+        return "".join(symbols)
+
+    def __len__(self):
+        return self.written + len(self.buffer)
+
+class FingerprintStack(Stack):
+    """Stack that keeps a polynomial hash of its contents up to date on every push and pop.
+
+    Element i from the bottom with code c contributes (c + 1) * BASE^i.
+    """
+    __slots__ = ("hash", "power")
+
+    def __init__(self, stack=None):
+        super().__init__()
+        self.hash = 0
+        # BASE^size
+        self.power = 1
+        if stack != None:
+            for symbol in stack.get_stack():
+                self.push(symbol)
+
+    def push(self, value):
+        Stack.push(self, value)
+        self.hash = (self.hash + (symbol_codes[value] + 1) * self.power) % FINGERPRINT_MODULUS
+        self.power = self.power * FINGERPRINT_BASE % FINGERPRINT_MODULUS
+
+    def pop(self):
+        value = Stack.pop(self)
+        if value != None:
+            self.power = self.power * FINGERPRINT_INVERSE % FINGERPRINT_MODULUS
+            self.hash = (self.hash - (symbol_codes[value] + 1) * self.power) % FINGERPRINT_MODULUS
+        return value
+
+    def fingerprint(self):
+        return (self.size, self.hash)
+
+    def contents(self):
+        items = self.items if self.counts == None else run_length_decode(self.items, self.counts)
+        return items.tobytes()
+
+class FingerprintQueue(Queue):
+    """Queue that keeps a polynomial hash of its contents up to date on every enqueue and dequeue.
+
+    Element n of the whole stream of enqueues with code c contributes (c + 1) * BASE^n;
+    the fingerprint divides by BASE^front so it only depends on the elements held.
+    """
+    __slots__ = ("hash", "back_power", "front_power", "front_inverse")
+
+    def __init__(self, queue=None):
+        super().__init__()
+        self.hash = 0
+        self.back_power = 1
+        self.front_power = 1
+        self.front_inverse = 1
+        if queue != None:
+            for symbol in queue.get_queue():
+                self.enqueue(symbol)
+            self.front = queue.front
+            self.back = queue.back
+
+    def enqueue(self, value):
+        Queue.enqueue(self, value)
+        self.hash = (self.hash + (symbol_codes[value] + 1) * self.back_power) % FINGERPRINT_MODULUS
+        self.back_power = self.back_power * FINGERPRINT_BASE % FINGERPRINT_MODULUS
+
+    def dequeue(self):
+        value = Queue.dequeue(self)
+        if value != None:
+            self.hash = (self.hash - (symbol_codes[value] + 1) * self.front_power) % FINGERPRINT_MODULUS
+            self.front_power = self.front_power * FINGERPRINT_BASE % FINGERPRINT_MODULUS
+            self.front_inverse = self.front_inverse * FINGERPRINT_INVERSE % FINGERPRINT_MODULUS
+        return value
+
+    def fingerprint(self):
+        return (self.size, self.hash * self.front_inverse % FINGERPRINT_MODULUS)
+
+    def contents(self):
+        items, counts = self.slots()
+        if counts != None:
+            items = run_length_decode(items, counts)
+        return items.tobytes()
+
+class FingerprintTape(Tape):
+    """Tape that keeps a polynomial hash of its cells up to date on every write.
+
+    The cell at position p with code c contributes c * BASE^p, so blank cells add nothing
+    and the blank cells created past the right end leave the hash alone. The left end and
+    the head are part of the fingerprint, since reading left of the left end fails.
+    """
+    __slots__ = ("hash",)
+
+    def __init__(self, tape=None):
+        super().__init__()
+        self.hash = 0
+        if tape != None:
+            self.cells = tape.cells
+            self.offset = tape.offset
+            self.left = tape.left
+            self.right = tape.right
+            self.head = tape.head
+            power = pow(FINGERPRINT_BASE, self.left, FINGERPRINT_MODULUS)
+            for code in self.cells[self.left + self.offset:self.right + self.offset + 1]:
+                self.hash = (self.hash + code * power) % FINGERPRINT_MODULUS
+                power = power * FINGERPRINT_BASE % FINGERPRINT_MODULUS
+
+    def write(self, value):
+        head = self.head
+        old = self.cells[head + self.offset] if self.left <= head <= self.right else 0
+        Tape.write(self, value)
+        difference = self.cells[head + self.offset] - old
+        if difference != 0:
+            self.hash = (self.hash + difference * pow(FINGERPRINT_BASE, head, FINGERPRINT_MODULUS)) % FINGERPRINT_MODULUS
+
+    def fingerprint(self):
+        return (self.left, self.head, self.hash)
+
+    def contents(self):
+        # Trailing blanks are left out, the tape behaves the same with or without them
+        right = self.right
+        while right >= self.left and self.cells[right + self.offset] == 0:
+            right -= 1
+        return (self.left, self.head, self.cells[self.left + self.offset:right + self.offset + 1].tobytes())
+
+def copy_structure(structure, share_buffers=False):
+    """Returns a copy of a Stack, Queue or Tape, or of a subclass, with buffers of its own unless share_buffers"""
+    copy = type(structure).__new__(type(structure))
+    for cls in type(structure).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            value = getattr(structure, slot)
+            if isinstance(value, array) and not share_buffers:
+                value = value[:]
+            setattr(copy, slot, value)
+    return copy
+
+def fingerprinted(memory):
+    """Returns a copy of a Stack, Queue or Tape that keeps a fingerprint of its contents"""
+    if isinstance(memory, (FingerprintStack, FingerprintQueue, FingerprintTape)):
+        return memory
+    elif isinstance(memory, Stack):
+        return FingerprintStack(memory)
+    elif isinstance(memory, Queue):
+        return FingerprintQueue(memory)
+    elif isinstance(memory, Tape):
+        return FingerprintTape(memory)
+    raise Exception("Cannot fingerprint " + type(memory).__name__)
\ No newline at end of file
@@ -0,0 +1,179 @@
+import os
+from array import array
+from multiprocessing import Pool
+from multiprocessing.shared_memory import SharedMemory
+from abstract_simulator import AbstractMachineSimulator
+from machine_compiler import OP_SCAN, OP_SCAN_RIGHT, ACCEPT, NOT_TERMINAL, NO_TRANSITION
+from machine_optimizer import optimize_machine_definition
+
+# Per-worker state, set once by init_worker()
+worker_machine = None
+worker_buffer = None
+worker_offsets = None
+worker_options = None
+
+def pack_inputs(inputs):
+    """Packs the input tapes into one shared memory block.
+
+    The block starts with len(inputs) + 1 int64 offsets followed by the UTF-8 bytes of
+    every tape, so input i is data[offsets[i]:offsets[i + 1]].
+    """
+    encoded = [input_tape.encode("utf-8") for input_tape in inputs]
+    offsets = array("q", [0])
+    for data in encoded:
+        offsets.append(offsets[-1] + len(data))
+
+    header = offsets.tobytes()
+    buffer = SharedMemory(create=True, size=max(1, len(header) + offsets[-1]))
+    buffer.buf[:len(header)] = header
+    position = len(header)
+    for data in encoded:
+        buffer.buf[position:position + len(data)] = data
+        position += len(data)
+    return buffer
+
+def init_worker(machine_definition, buffer_name, count, is_turing_machine, max_steps, timeout):
+    global worker_machine, worker_buffer, worker_offsets, worker_options
+    worker_machine = AbstractMachineSimulator(machine_definition)
+    worker_buffer = SharedMemory(name=buffer_name)
+    worker_offsets = array("q")
+    worker_offsets.frombytes(bytes(worker_buffer.buf[:8 * (count + 1)]))
+    worker_options = {"is_turing_machine": is_turing_machine, "max_steps": max_steps, "timeout": timeout}
+
+def run_chunk(bounds):
+    start, end = bounds
+    base = len(worker_offsets) * 8
+    inputs = [
+        bytes(worker_buffer.buf[base + worker_offsets[i]:base + worker_offsets[i + 1]]).decode("utf-8")
+        for i in range(start, end)
+    ]
+    return worker_machine.run_batch(inputs, **worker_options)
+
+def run_batch_parallel(machine_definition, inputs, processes=None, chunk_size=None, is_turing_machine=False, max_steps=None, timeout=None):
+    """Runs every input tape on a pool of worker processes and returns the RunResults in input order.
+
+    machine_definition is the dictionary returned by InputParser.parse(). It is sent to each
+    worker once, together with the name of a shared buffer holding all of the input tapes;
+    the workers are then only sent (start, end) index ranges.
+    """
+    inputs = list(inputs)
+    if processes == None:
+        processes = os.cpu_count() or 1
+    if len(inputs) == 0:
+        return []
+    if chunk_size == None:
+        # A few chunks per worker keeps them busy when run times vary between tapes
+        chunk_size = max(1, min(4096, len(inputs) // (processes * 4)))
+
+    buffer = pack_inputs(inputs)
+    try:
+        chunks = [(start, min(start + chunk_size, len(inputs))) for start in range(0, len(inputs), chunk_size)]
+        initargs = (machine_definition, buffer.name, len(inputs), is_turing_machine, max_steps, timeout)
+        results = []
+        with Pool(processes, initializer=init_worker, initargs=initargs) as pool:
+            for chunk_results in pool.imap(run_chunk, chunks):
+                results.extend(chunk_results)
+        return results
+    finally:
+        buffer.close()
+        buffer.unlink()
+
+def build_dfa_matrix(compiled):
+    """Builds the NumPy transition matrix of a SCAN-only compiled machine.
+
+    Rows are the compiled states followed by an absorbing accept code and an absorbing dead
+    code; terminal states are folded into those two. Columns are the symbol codes, the
+    unknown symbol column, and a padding column that leaves every state unchanged.
+    """
+    import numpy as np
+
+    count = len(compiled.state_names)
+    accept_code = count
+    dead_code = count + 1
+    pad_column = compiled.width
+
+    # Where entering each state actually leads
+    entering = np.arange(count + 2, dtype=np.int32)
+    for state in range(count):
+        if compiled.terminal[state] == ACCEPT:
+            entering[state] = accept_code
+        elif compiled.terminal[state] != NOT_TERMINAL:
+            entering[state] = dead_code
+        elif compiled.errors[state] == "Undefined state: " + compiled.state_names[state]:
+            # run_fast halts with an Undefined state error there, which does not accept either
+            entering[state] = dead_code
+        elif compiled.opcodes[state] not in (OP_SCAN, OP_SCAN_RIGHT):
+            raise Exception("Vectorized execution requires a machine made of SCAN states. State " + compiled.state_names[state] + " is not.")
+
+    matrix = np.empty((count + 2, pad_column + 1), dtype=np.int32)
+    matrix[accept_code, :] = accept_code
+    matrix[dead_code, :] = dead_code
+    for state in range(count):
+        if entering[state] != state:
+            matrix[state, :] = entering[state]
+            continue
+        row = np.array(compiled.table[state], dtype=np.int32)
+        matrix[state, :pad_column] = np.where(row == NO_TRANSITION, dead_code, entering[np.maximum(row, 0)])
+        matrix[state, pad_column] = state
+    return matrix, int(entering[compiled.start_state])
+
+def run_batch_vectorized(machine_definition, inputs, block_size=65536, check_interval=32):
+    """Classifies input tapes on a SCAN-only machine with NumPy and returns a boolean array of accepted flags.
+
+    Each block of tapes is encoded as a 2-D array of symbol codes (one column per SCAN,
+    shorter tapes padded), and the whole block advances one column at a time through the
+    transition matrix. Once the tapes run out the machine keeps reading # blanks, so the
+    final verdict is looked up in a table of where following # from each state leads.
+    Machines that would loop forever on those blanks are reported as not accepted.
+    """
+    import numpy as np
+
+    # Only the verdicts are returned, so the minimized machine gives the same answers on a smaller matrix
+    machine = AbstractMachineSimulator(optimize_machine_definition(machine_definition))
+    compiled = machine.compiled
+    if compiled.start_state == None:
+        raise Exception("Machine has no states")
+    matrix, start = build_dfa_matrix(compiled)
+    accept_code = matrix.shape[0] - 2
+    pad_column = compiled.width
+
+    # Only single characters can ever be read from a tape cell
+    single = sorted((ord(symbol), code) for symbol, code in compiled.symbol_codes.items() if len(symbol) == 1)
+    lookup_keys = np.array([key for key, _ in single] + [0xFFFFFFFF], dtype=np.uint32)
+    lookup_codes = np.array([code for _, code in single] + [compiled.unknown_code], dtype=np.int32)
+
+    # Follow # from every state until it is absorbed, by repeatedly squaring the blank transition
+    blank = matrix[:, compiled.symbol_codes.get("#", compiled.unknown_code)]
+    for _ in range(int(matrix.shape[0]).bit_length() + 1):
+        blank = blank[blank]
+    accepted_at_end = blank == accept_code
+
+    inputs = list(inputs)
+    accepted = np.zeros(len(inputs), dtype=bool)
+    for block_start in range(0, len(inputs), block_size):
+        block = inputs[block_start:block_start + block_size]
+        for input_tape in block:
+            if not isinstance(input_tape, str):
+                raise Exception("Input tape must be a string")
+            if input_tape[0] != "#" or input_tape[-1] != "#":
+                raise Exception("Input tape must start and end with #")
+
+        # The head starts on the leading #, so the first SCAN reads the second cell
+        strings = np.array([input_tape[1:] for input_tape in block], dtype=str)
+        points = strings.view(np.uint32).reshape(len(block), -1)
+        width = points.shape[1]
+        lengths = np.char.str_len(strings)
+
+        positions = np.minimum(np.searchsorted(lookup_keys, points), len(lookup_keys) - 1)
+        codes = np.where(lookup_keys[positions] == points, lookup_codes[positions], compiled.unknown_code)
+        codes[np.arange(width)[None, :] >= lengths[:, None]] = pad_column
+        codes = np.ascontiguousarray(codes.T, dtype=np.int32)
+
+        states = np.full(len(block), start, dtype=np.int32)
+        for column in range(width):
+            states = matrix[states, codes[column]]
+            if column % check_interval == 0 and (states >= accept_code).all():
+                break
+
+        accepted[block_start:block_start + len(block)] = accepted_at_end[states]
+    return accepted
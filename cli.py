@@ -0,0 +1,144 @@
+"""
+    Headless command line runner for the Abstract Machine Interpreter.
+
+    Runs an MDL machine on input tapes given as arguments, read from a file (one tape
+    per line) or read from stdin, and writes one JSON result per tape. The grapher and
+    its plotting dependencies are only imported when --graph is used.
+
+    python cli.py machine.mdl "#aab#" "#abb#"
+    python cli.py machine.mdl --inputs tapes.txt --max-steps 100000 --detect-loops > results.jsonl
+    python cli.py machine.mdl --inputs tapes.txt --minimize
+"""
+
+import sys, json, argparse
+
+from input_parser import InputParser
+from abstract_simulator import AbstractMachineSimulator
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Run an abstract machine on input tapes and print JSONL results.")
+    parser.add_argument("machine", help="MDL file describing the machine")
+    parser.add_argument("tapes", nargs="*", help="input tapes, such as #aabb#")
+    parser.add_argument("-i", "--inputs", help="file with one input tape per line, or - for stdin")
+    parser.add_argument("-o", "--output", help="write the results to this file instead of stdout")
+    parser.add_argument("--max-steps", type=int, default=None, help="stop each run after this many instructions")
+    parser.add_argument("--timeout", type=float, default=None, help="stop each run after this many seconds")
+    parser.add_argument("--nondeterministic", action="store_true", help="explore every transition breadth-first; --max-steps then counts configurations")
+    parser.add_argument("--detect-loops", action="store_true", help="stop a run with halt_reason looping once it repeats a configuration")
+    parser.add_argument("--minimize", action="store_true", help="run SCAN-only machines minimized; acceptance is unchanged but steps and halt reasons may differ")
+    parser.add_argument("--cache", action="store_true", help="load the compiled machine from the on-disk cache")
+    parser.add_argument("--cache-dir", default=None, help="directory of the on-disk cache")
+    parser.add_argument("--graph", metavar="PNG", help="also draw the machine graph to this file")
+    arguments = parser.parse_args(argv)
+    if arguments.minimize and arguments.nondeterministic:
+        # Minimization keeps the last transition on a symbol, like the deterministic simulator does
+        parser.error("--minimize cannot be combined with --nondeterministic")
+    return arguments
+
+def read_tapes(file):
+    for line in file:
+        line = line.rstrip("\r\n")
+        if line != "":
+            yield line
+
+def input_tapes(arguments):
+    # Tapes from the command line come first, then the ones from --inputs
+    for tape in arguments.tapes:
+        yield tape
+    if arguments.inputs == "-" or (arguments.inputs == None and len(arguments.tapes) == 0):
+        yield from read_tapes(sys.stdin)
+    elif arguments.inputs != None:
+        with open(arguments.inputs, "r", encoding="utf-8") as file:
+            yield from read_tapes(file)
+
+def load_machine(arguments):
+    with open(arguments.machine, "r", encoding="utf-8") as file:
+        source = file.read()
+    if arguments.cache or arguments.cache_dir != None:
+        from machine_cache import MachineCache
+        return MachineCache(arguments.cache_dir).load(source)
+    return AbstractMachineSimulator(InputParser(source).parse())
+
+def minimize_machine(machine):
+    from machine_optimizer import optimize_machine_definition
+    # Machines that are not made only of SCAN states are returned as they are
+    definition = {"logic": machine.logic, "aux_data": machine.aux_data}
+    optimized = optimize_machine_definition(definition)
+    if optimized is definition:
+        return machine
+    return AbstractMachineSimulator(optimized)
+
+def draw_graph(machine, path):
+    # Plotting is only needed here, and must not require a display
+    import matplotlib
+    matplotlib.use("Agg")
+    from abstract_grapher import render_abstract_machine
+    image = render_abstract_machine(machine.logic)
+    with open(path, "wb") as file:
+        file.write(image)
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+
+    try:
+        machine = load_machine(arguments)
+    except (OSError, SyntaxError) as e:
+        print("Error: " + str(e), file=sys.stderr)
+        return 1
+
+    if arguments.graph != None:
+        draw_graph(machine, arguments.graph)
+
+    options = {"max_steps": arguments.max_steps, "timeout": arguments.timeout}
+    if arguments.nondeterministic:
+        # The breadth-first search already stops on repeated configurations
+        from nondeterministic_simulator import NondeterministicSimulator
+        from lazy_dfa import LazyDFASimulator, scan_acceptor_error
+        definition = {"logic": machine.logic, "aux_data": machine.aux_data}
+        nondeterministic = NondeterministicSimulator(definition)
+        if scan_acceptor_error(nondeterministic) == None:
+            # Finite acceptors run through a DFA built on demand; steps are then symbols read
+            machine = LazyDFASimulator(definition, state_map=machine.state_map, compiled=machine.compiled)
+        else:
+            machine = nondeterministic
+    else:
+        if arguments.minimize:
+            machine = minimize_machine(machine)
+        options["detect_loops"] = arguments.detect_loops
+
+    # Same rule as the app: the first aux tape becomes the input tape
+    is_turing_machine = False
+    for key in machine.aux_data.keys():
+        if machine.aux_data[key]["type"] == "TAPE":
+            is_turing_machine = True
+            break
+
+    output = sys.stdout if arguments.output == None else open(arguments.output, "w", encoding="utf-8")
+    interactive = output.isatty()
+    try:
+        # Tapes are read one at a time, so results stream out while stdin is still open
+        for tape in input_tapes(arguments):
+            result = machine.run_batch([tape], is_turing_machine=is_turing_machine, **options)[0]
+            record = {
+                "input": tape,
+                "accepted": result.accepted,
+                "halt_reason": result.halt_reason,
+                "steps": result.steps,
+                "output": result.output
+            }
+            if result.error != None:
+                record["error"] = result.error
+            output.write(json.dumps(record) + "\n")
+            if interactive:
+                output.flush()
+        output.flush()
+    except BrokenPipeError:
+        # The reader went away, e.g. piped into head
+        return 0
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
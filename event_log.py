@@ -0,0 +1,92 @@
+from collections import deque
+
+# Simulator event codes
+EVENT_START = 0
+EVENT_ACCEPT = 1
+EVENT_REJECT = 2
+EVENT_HALT = 3
+EVENT_READ = 4
+EVENT_READ_RIGHT = 5
+EVENT_READ_LEFT = 6
+EVENT_READ_MEMORY = 7
+EVENT_WRITE = 8
+EVENT_PRINT = 9
+EVENT_REPLACE = 10
+EVENT_TRANSITION = 11
+EVENT_TRANSITIONING = 12
+EVENT_NO_TRANSITION = 13
+# Free-form message, such as the ones the app adds between steps
+EVENT_MESSAGE = 14
+EVENT_LOOP = 15
+
+event_formats = {
+    EVENT_START: "Starting at state {}",
+    EVENT_ACCEPT: "Accepted and halted.",
+    EVENT_REJECT: "Rejected and halted.",
+    EVENT_HALT: "Halted.",
+    EVENT_READ: "Read symbol {}",
+    EVENT_READ_RIGHT: "Read symbol {} from the right",
+    EVENT_READ_LEFT: "Read symbol {} from the left",
+    EVENT_READ_MEMORY: "Read symbol {} from {}",
+    EVENT_WRITE: "Wrote symbol {} to {}",
+    EVENT_PRINT: "Printed symbol {}",
+    EVENT_REPLACE: "Replaced symbol {} with {}",
+    EVENT_TRANSITION: "Transitioned to state {}",
+    EVENT_TRANSITIONING: "Transitioning to state {}",
+    EVENT_NO_TRANSITION: "No transitions found for this symbol. Halted.",
+    EVENT_MESSAGE: "{}",
+    EVENT_LOOP: "Configuration repeated, the machine loops forever. Halted."
+}
+
+def format_event(code, arguments):
+    return event_formats[code].format(*arguments)
+
+class EventSink:
+    """Bounded ring buffer of simulator events, formatted only when they are read.
+
+    Events are stored as (code, arguments) tuples. Only the last capacity events are
+    kept; older ones are counted as dropped. When a flush callback is given it receives
+    the formatted lines of the new events in batches of flush_size, and flush() hands
+    over whatever is left.
+    """
+
+    def __init__(self, capacity=10000, flush=None, flush_size=1000):
+        self.events = deque(maxlen=capacity)
+        self.callback = flush
+        self.flush_size = flush_size
+        # Events recorded since the last flush, including dropped ones
+        self.pending = 0
+
+    def emit(self, code, arguments):
+        self.events.append((code, arguments))
+        self.pending += 1
+        if self.callback != None and self.pending >= self.flush_size:
+            self.flush()
+
+    def drain(self):
+        """Returns the formatted lines of the events recorded since the last drain or flush"""
+        retained = min(self.pending, len(self.events))
+        lines = []
+        if self.pending > retained:
+            lines.append("... " + str(self.pending - retained) + " events not shown")
+        for i in range(len(self.events) - retained, len(self.events)):
+            code, arguments = self.events[i]
+            lines.append(format_event(code, arguments))
+        self.pending = 0
+        return lines
+
+    def flush(self):
+        lines = self.drain()
+        if self.callback != None and len(lines) > 0:
+            self.callback(lines)
+
+    def lines(self):
+        """Returns the formatted lines of every retained event"""
+        return [format_event(code, arguments) for code, arguments in self.events]
+
+    def clear(self):
+        self.events.clear()
+        self.pending = 0
+
+    def __len__(self):
+        return len(self.events)
@@ -1,242 +1,312 @@
 import re
 from aux_data_structures import Stack, Queue, Tape
 
+# Line patterns, compiled once
+comment_pattern = re.compile(r"\s*//")
+section_pattern = re.compile(r"\.(DATA|LOGIC)\s*$")
+declaration_pattern = re.compile(r"(STACK|QUEUE|TAPE)\s[a-zA-Z0-9_]*")
+state_pattern = re.compile(r"[a-zA-Z0-9_]*\] (SCAN|PRINT|SCAN RIGHT|SCAN LEFT|READ|WRITE|RIGHT|LEFT|UP|DOWN)")
+command_pattern = re.compile(r"\s*(" + "|".join([
+    r"SCAN LEFT",
+    r"SCAN RIGHT",
+    r"SCAN",
+    r"PRINT",
+    r"READ\([a-zA-Z0-9_]{1,}\)",
+    r"WRITE\([a-zA-Z0-9_]{1,}\)",
+    r"RIGHT\([a-zA-Z0-9_]{1,}\)",
+    r"LEFT\([a-zA-Z0-9_]{1,}\)",
+    r"UP\([a-zA-Z0-9_]{1,}\)",
+    r"DOWN\([a-zA-Z0-9_]{1,}\)"
+]) + ")")
+argument_pattern = re.compile(r"\([^\s]*,[^\s]*\)")
+
+class LineToken:
+    """Classification of a single source line, independent of the section it appears in"""
+    __slots__ = ("kind", "name", "value", "arguments", "column", "error")
+
+    def __init__(self, kind, name=None, value=None, arguments=None, column=1, error=None):
+        # blank, section, declaration, state or invalid
+        self.kind = kind
+        # Section, data structure or state name
+        self.name = name
+        # Data structure type or instruction
+        self.value = value
+        # List of (argument, column) for states
+        self.arguments = arguments
+        self.column = column
+        # Error message (without the line number) for malformed declarations and states
+        self.error = error
+
+    def definition(self, line_number):
+        # The aux_data or logic entry for a valid declaration or state
+        if self.kind == "declaration":
+            return {
+                "type": self.value,
+                "line": line_number,
+                "column": self.column
+            }
+        return {
+            "instruction": self.value,
+            "arguments": [argument for argument, _ in self.arguments],
+            "line": line_number,
+            "column": self.column
+        }
+
+def tokenize_line(line):
+    if line.strip() == "" or comment_pattern.match(line):
+        return LineToken("blank")
+
+    match = section_pattern.match(line)
+    if match:
+        return LineToken("section", name=match.group(1))
+
+    if state_pattern.match(line):
+        state_end = line.find("]")
+        name = line[:state_end]
+        rest = line[state_end + 1:]
+        command = command_pattern.match(rest)
+        if not command:
+            return LineToken("state", name=name, error="Expected command")
+        arguments = [(argument.group(), state_end + 2 + argument.start()) for argument in argument_pattern.finditer(rest)]
+        return LineToken("state", name=name, value=command.group(1), arguments=arguments)
+
+    if declaration_pattern.match(line):
+        declarations = line.split()
+        if len(declarations) > 2:
+            return LineToken("declaration", error="Too many arguments for declaration")
+        if len(declarations) < 2:
+            return LineToken("invalid")
+        return LineToken("declaration", name=declarations[1], value=declarations[0], column=line.find(declarations[1], line.find(declarations[0]) + len(declarations[0])) + 1)
+
+    return LineToken("invalid")
+
+def definition_changed(old, new):
+    # Line and column alone do not change what a declaration or state means
+    for key in new.keys():
+        if key not in ("line", "column") and old.get(key) != new[key]:
+            return True
+    return False
+
+def patch_definitions(target, source):
+    """Makes target equal to source in place and returns the keys whose definition changed"""
+    changes = set()
+    for key in list(target.keys()):
+        if key not in source:
+            del target[key]
+            changes.add(key)
+    for key, value in source.items():
+        if key not in target or definition_changed(target[key], value):
+            changes.add(key)
+        target[key] = value
+
+    # The first state is the start state, so the declaration order must follow the source
+    if list(target.keys()) != list(source.keys()):
+        target.clear()
+        target.update(source)
+    return changes
+
 class InputParser:
     def __init__(self, input_string):
+        self.errors = []
+        self.result = None
+        # Tokens of the current lines and the context each line ends in
+        self.tokens = None
+        self.contexts = None
+        # Tokens keyed by line content, reused by update()
+        self.token_cache = {}
+        # Set when update() failed, so the tokens no longer match the result
+        self.stale = False
+        self.set_source(input_string)
+
+    def set_source(self, input_string):
         self.input_string = input_string
         self.input_lines = input_string.strip().splitlines()
+        # Lines dropped by strip(), so reported line numbers match the original text
+        self.line_offset = input_string[:len(input_string) - len(input_string.lstrip())].count("\n")
 
-        self.contexts = {"GLOBAL": {}, "DATA": {}, "LOGIC": {}}
-        self.current_context_space = "GLOBAL"
-        self.iterator_line = 0
-
-        self.data_keywords = [
-            "STACK",
-            "QUEUE",
-            "TAPE"
-        ]
-        self.data_keywords = re.compile("^" + "|".join(self.data_keywords))
-
-        self.command_keywords = [
-            "SCAN LEFT",
-            "SCAN RIGHT",
-            "SCAN",
-            "PRINT",
-            "READ\([a-zA-Z0-9_]{1,}\)",
-            "WRITE\([a-zA-Z0-9_]{1,}\)",
-            "RIGHT\([a-zA-Z0-9_]{1,}\)",
-            "LEFT\([a-zA-Z0-9_]{1,}\)",
-            "UP\([a-zA-Z0-9_]{1,}\)",
-            "DOWN\([a-zA-Z0-9_]{1,}\)"
-        ]
-        self.command_keywords = re.compile("^\s*(" + "|".join(self.command_keywords) + ")")
-
-    def reset_iterator(self):
-        self.iterator_line = 0
-        self.current_context_space = "GLOBAL"
-
-    def iterate_line(self, verbose=False):
-        # Read line until not blank or comment
-        while self.iterator_line < len(self.input_lines) and (self.input_lines[self.iterator_line] == "" or re.match("\s*//", self.input_lines[self.iterator_line])):
-            self.iterator_line += 1
-
-        while self.iterator_line < len(self.input_lines):
-            line = self.input_lines[self.iterator_line]
-            if verbose: print("Iterator read: " + line + " (" + str(self.iterator_line) + ")")
-
-            # Increment iterator
-            self.iterator_line += 1
-
-            # If blank line, continue
-            if line == "":
-                continue
-
-            # If comment, continue
-            if re.match("\s*//", line):
-                continue
-
-            # Check if we're in a non-global context    
-            if self.current_context_space == "GLOBAL":
-                # Expect new context
-                if not re.match("\.DATA|\.LOGIC", line):
-                    raise SyntaxError("Expected new context at line " + str(self.iterator_line))
-                else:
-                    # Assign new context
-                    self.current_context_space = line[1:]
-                    if verbose: print("Context changed to " + self.current_context_space)
-                return line
-            elif self.current_context_space == "DATA":
-                # Check for context change
-                if re.match("\.LOGIC", line):
-                    self.current_context_space = "LOGIC"
-                    if verbose: print("Context changed to " + self.current_context_space)
-                return line
-            elif self.current_context_space == "LOGIC":
-                # Check for context change
-                if re.match("\.DATA", line):
-                    self.current_context_space = "DATA"
-                    if verbose: print("Context changed to " + self.current_context_space)
-                return line
-                
     def parse(self):
-        # Check syntax
-        self.check_syntax()
-
-        # Parse
-        aux_data = self.parse_data()
-        logic = self.parse_logic()
-
-        return { "aux_data": aux_data, "logic": logic }
-
-    def parse_data(self):
-        # Parse the data section
-        self.reset_iterator()
-
-        data_structures = {}
-        
-        while self.current_context_space != "DATA" and self.iterator_line < len(self.input_lines):
-            self.iterate_line()
-        
-        while self.current_context_space == "DATA":
-            line = self.iterate_line()
-
-            # Break if end of context
-            if line == None or self.current_context_space != "DATA":
-                break
-            
-            # Ignore empty line
-            if line == "":
-                continue
-            
-            # Split declaration by spaces
-            declarations = line.split(" ")
-
-            # If more than 2 arguments, raise error
-            if len(declarations) > 2:
-                raise SyntaxError("Too many arguments for declaration at line " + str(self.iterator_line))
-
-            # Get data structure type
-            data_structure_type = declarations[0]
-
-            # Get data structure name
-            data_structure_name = declarations[1]
-
-            # Raise error if data structure already exists
-            if data_structure_name in data_structures:
-                raise SyntaxError("Data structure " + data_structure_name + " already exists at line " + str(self.iterator_line))
-
-            # Create data structure
-            if data_structure_type == "STACK":
-                data_structures[data_structure_name] = {
-                    "type": "STACK",
-                }
-            elif data_structure_type == "QUEUE":
-                data_structures[data_structure_name] = {
-                    "type": "QUEUE",
-                }
-            elif data_structure_type == "TAPE":
-                data_structures[data_structure_name] = {
-                    "type": "TAPE",
-                }
+        """Parses the source in a single pass, raising one SyntaxError that lists every error found"""
+        if self.result == None:
+            self.tokens = self.tokenize(self.input_lines)
+            self.result = self.parse_tokens(self.tokens)
+        return self.result
+
+    def tokenize(self, lines):
+        # Only lines that are not in the cache are matched against the patterns again
+        cache = self.token_cache
+        tokens = []
+        for line in lines:
+            token = cache.get(line)
+            if token == None:
+                token = tokenize_line(line)
+                cache[line] = token
+            tokens.append(token)
+        return tokens
+
+    def update(self, input_string):
+        """Re-parses the source after an edit, re-tokenizing only the lines that changed.
+
+        The aux_data and logic dictionaries of the previous result are patched in place and
+        the names of the data structures and states that were added, changed or removed are
+        returned as (aux_data_changes, logic_changes). On a syntax error nothing is patched.
+        """
+        old_lines = self.input_lines
+        old_tokens = self.tokens
+        old_offset = self.line_offset
+        self.set_source(input_string)
+        if self.result == None:
+            result = self.parse()
+            return set(result["aux_data"].keys()), set(result["logic"].keys())
+
+        # Find the edited region between the unchanged first and last lines
+        lines = self.input_lines
+        start = 0
+        limit = min(len(old_lines), len(lines))
+        while start < limit and old_lines[start] == lines[start]:
+            start += 1
+        old_end = len(old_lines)
+        new_end = len(lines)
+        while old_end > start and new_end > start and old_lines[old_end - 1] == lines[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+
+        self.tokens = old_tokens[:start] + self.tokenize(lines[start:new_end]) + old_tokens[old_end:]
+        if len(self.token_cache) > 2 * len(lines) + 1024:
+            self.token_cache = dict(zip(lines, self.tokens))
+
+        changes = None
+        if not self.stale and self.line_offset == old_offset:
+            changes = self.patch_region(old_tokens, start, old_end, new_end)
+        if changes == None:
+            # Errors, or an edit that changes the context of the lines after it
+            self.stale = True
+            result = self.parse_tokens(self.tokens)
+            self.stale = False
+            changes = (
+                patch_definitions(self.result["aux_data"], result["aux_data"]),
+                patch_definitions(self.result["logic"], result["logic"])
+            )
+        return changes
+
+    def patch_region(self, old_tokens, start, old_end, new_end):
+        """Replaces the definitions of old lines start..old_end with those of new lines start..new_end.
+
+        Returns None when the full pass is needed instead, either to report errors or
+        because the edit changed the section that the following lines belong to.
+        """
+        contexts = self.contexts
+        context = contexts[start - 1] if start > 0 else "GLOBAL"
+        new_contexts = []
+        added = {"DATA": [], "LOGIC": []}
+        for i in range(start, new_end):
+            token = self.tokens[i]
+            if token.kind == "section":
+                context = token.name
+            elif token.kind != "blank":
+                if token.error != None or (context, token.kind) not in (("DATA", "declaration"), ("LOGIC", "state")):
+                    return None
+                added[context].append((token.name, token.definition(i + 1 + self.line_offset)))
+            new_contexts.append(context)
+
+        old_context = contexts[old_end - 1] if old_end > 0 else "GLOBAL"
+        if old_end < len(old_tokens) and context != old_context:
+            return None
+
+        # Check for duplicates before anything is patched
+        removed = {}
+        for section, key in (("DATA", "aux_data"), ("LOGIC", "logic")):
+            definitions = self.result[key]
+            removed[section] = [old_tokens[i].name for i in range(start, old_end) if old_tokens[i].kind in ("declaration", "state") and contexts[i] == section]
+            names = [name for name, _ in added[section]]
+            if len(set(names)) != len(names):
+                return None
+            for name in names:
+                if name in definitions and name not in removed[section]:
+                    return None
+
+        changes = {}
+        for section, key in (("DATA", "aux_data"), ("LOGIC", "logic")):
+            definitions = self.result[key]
+            names = [name for name, _ in added[section]]
+            section_changes = set(removed[section]) ^ set(names)
+            for name, definition in added[section]:
+                if name in definitions and definition_changed(definitions[name], definition):
+                    section_changes.add(name)
+            changes[key] = section_changes
+
+            # Lines after the edit moved by the number of lines inserted or deleted
+            shift = new_end - old_end
+            if shift != 0:
+                last_line = old_end + self.line_offset
+                for definition in definitions.values():
+                    if definition["line"] > last_line:
+                        definition["line"] += shift
+
+            if removed[section] == names:
+                for name, definition in added[section]:
+                    definitions[name] = definition
             else:
-                raise SyntaxError("Invalid data structure type at line " + str(self.iterator_line))
-
-        return data_structures
-                
-
-    def parse_logic(self):
-        # Parse the logic section
-        self.reset_iterator()
-
+                for name in removed[section]:
+                    del definitions[name]
+                for name, definition in added[section]:
+                    definitions[name] = definition
+                # Move the definitions after the edit back behind the new ones
+                kind = "declaration" if section == "DATA" else "state"
+                for i in range(old_end, len(old_tokens)):
+                    if old_tokens[i].kind == kind and contexts[i] == section:
+                        definitions[old_tokens[i].name] = definitions.pop(old_tokens[i].name)
+
+        self.contexts = contexts[:start] + new_contexts + contexts[old_end:]
+        return changes["aux_data"], changes["logic"]
+
+    def parse_tokens(self, tokens):
+        data_structures = {}
         logic = {}
+        self.errors = []
+        self.contexts = []
+        context = "GLOBAL"
+
+        for i in range(len(tokens)):
+            token = tokens[i]
+            line_number = i + 1 + self.line_offset
+
+            # Section headers may appear in any context
+            if token.kind == "section":
+                context = token.name
+            elif token.kind == "blank":
+                pass
+            elif context == "GLOBAL":
+                self.errors.append("Expected new context at line " + str(line_number))
+            elif context == "DATA":
+                if token.kind != "declaration":
+                    self.errors.append("Expected data structure declaration at line " + str(line_number) + " in context DATA. Got " + self.input_lines[i])
+                elif token.error != None:
+                    self.errors.append(token.error + " at line " + str(line_number))
+                elif token.name in data_structures:
+                    self.errors.append("Data structure " + token.name + " already exists at line " + str(line_number))
+                else:
+                    data_structures[token.name] = token.definition(line_number)
+            elif context == "LOGIC":
+                if token.kind != "state":
+                    self.errors.append("Expected logic instruction at line " + str(line_number) + " in context LOGIC. Got " + self.input_lines[i])
+                elif token.error != None:
+                    self.errors.append(token.error + " at line " + str(line_number))
+                elif token.name in logic:
+                    self.errors.append("State " + token.name + " already exists at line " + str(line_number))
+                else:
+                    logic[token.name] = token.definition(line_number)
+            self.contexts.append(context)
 
-        while self.current_context_space != "LOGIC":
-            self.iterate_line()
-
-        while self.current_context_space == "LOGIC":
-            line = self.iterate_line()
-
-            # Break if end of context
-            if line == None or self.current_context_space != "LOGIC":
-                break
-            
-            # Ignore empty line
-            if line == "":
-                continue
-
-            # Read the states
-            # State format: <state_name>] <instruction> <arguments>
-
-            # Find the first ] in the line
-            state_end = line.find("]")
-            if state_end == -1:
-                raise SyntaxError("Expected ] at line " + str(self.iterator_line))
-            state_name = line[:state_end]
-            line = line[state_end + 1:]
-
-            # RegEx matching to look for command)
-            command_matches = self.command_keywords.findall(line)
-            if len(command_matches) == 0:
-                raise SyntaxError("Expected command at line " + str(self.iterator_line))
-            instruction = command_matches[0]
-
-            # Get arguments
-            arguments_idx = re.findall("\([^\s]*,[^\s]*\)", line)
-
-            # Raise error if state already exists
-            if state_name in logic:
-                raise SyntaxError("State " + state_name + " already exists at line " + str(self.iterator_line))
-            
-            # Create instruction object
-            logic[state_name] = {
-                "instruction": instruction,
-                "arguments": arguments_idx
-            }
+        if len(self.errors) > 0:
+            raise SyntaxError("\n".join(self.errors))
 
-        return logic
+        return { "aux_data": data_structures, "logic": logic }
 
     def check_syntax(self):
-        # Reset iterator
-        self.reset_iterator()
-
-        # Check for syntax errors
-        for i in range(len(self.input_lines)):
-            # Check for empty lines
-            if self.input_lines[i] == "":
-                continue
-
-            # Ignore if comment
-            if re.match("\s*//", self.input_lines[i]):
-                continue
-
-            # Check if we're in a non-global context
-            if self.current_context_space == "GLOBAL":
-                # Expect new context
-                if not re.match("\.DATA|\.LOGIC", self.input_lines[i]):
-                    raise SyntaxError("Expected new context at line " + str(i + 1))
-                else:
-                    # Assign new context
-                    self.current_context_space = self.input_lines[i][1:]
-            elif self.current_context_space == "DATA":
-                # Check for context change
-                if re.match("\.LOGIC", self.input_lines[i]):
-                    self.current_context_space = "LOGIC"
-                    continue
-
-                # Succeeding lines must be data structure declarations
-                if not re.match("(STACK|QUEUE|TAPE)\s[a-zA-Z0-9_]*", self.input_lines[i]):
-                    raise SyntaxError("Expected data structure declaration at line " + str(i + 1) + " in context " + self.current_context_space + ". Got " + self.input_lines[i])
-
-            elif self.current_context_space == "LOGIC":
-                # Check for context change
-                if re.match("\.DATA", self.input_lines[i]):
-                    self.current_context_space = "DATA"
-                    continue
-
-                # Succeeding lines must be logic instructions
-                if not re.match("[a-zA-Z0-9_]*] (SCAN|PRINT|SCAN RIGHT|SCAN LEFT|READ|WRITE|RIGHT|LEFT|UP|DOWN)", self.input_lines[i]):
-                    raise SyntaxError("Expected logic instruction at line " + str(i + 1) + " in context " + self.current_context_space + ". Got " + self.input_lines[i])
+        self.parse()
 
-            else:
-                raise NameError("Unknown context space: " + self.current_context_space)
-            
+    def parse_data(self):
+        return self.parse()["aux_data"]
+
+    def parse_logic(self):
+        return self.parse()["logic"]
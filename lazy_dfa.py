@@ -0,0 +1,204 @@
+from abstract_simulator import AbstractMachineSimulator
+from aux_data_structures import StreamingInputTape
+from event_log import EVENT_START, EVENT_ACCEPT, EVENT_REJECT, EVENT_READ, EVENT_TRANSITION
+from machine_compiler import NOT_TERMINAL, ACCEPT, OP_SCAN, OP_SCAN_RIGHT
+from nondeterministic_simulator import NondeterministicSimulator
+
+# Estimated bytes held by a cached DFA state, per NFA state in its set, and per cached transition
+DFA_STATE_COST = 200
+DFA_SET_ENTRY_COST = 16
+DFA_TRANSITION_COST = 100
+
+def scan_acceptor_error(nfa):
+    """Returns why a NondeterministicSimulator's machine cannot run through a LazyDFA, or None if it can"""
+    if nfa.start_state == None:
+        return "Machine has no states"
+    for state, (opcode, _, choices) in nfa.states.items():
+        if opcode == None:
+            return choices
+        if opcode not in (OP_SCAN, OP_SCAN_RIGHT):
+            return "Lazy DFA execution needs a machine of SCAN states only. State " + nfa.state_names[state] + " is not one."
+    return None
+
+class LazyDFA:
+    """Subset construction done on demand, with a bounded cache of DFA states as in RE2.
+
+    Each set of NFA states met while running becomes a DFA state, and its row of
+    transitions is filled in as symbols are read, so only the part of the DFA an input
+    actually visits is ever built. When the estimated size of the cache would pass
+    memory_limit bytes the whole cache is dropped and construction starts over from the
+    state being left.
+    """
+
+    def __init__(self, nfa, memory_limit=8 * 1024 * 1024):
+        self.nfa = nfa
+        self.memory_limit = memory_limit
+        self.flushes = 0
+        self.clear()
+
+    def clear(self):
+        self.ids = {}
+        self.sets = []
+        self.rows = []
+        # A DFA state stops the run when it holds an accept state or no state that can read
+        self.accepting = []
+        self.stop = []
+        self.size = 0
+
+    def intern(self, states):
+        state = self.ids.get(states)
+        if state == None:
+            terminal = self.nfa.terminal
+            state = len(self.sets)
+            self.ids[states] = state
+            self.sets.append(states)
+            self.rows.append({})
+            accepting = any(terminal[s] == ACCEPT for s in states)
+            self.accepting.append(accepting)
+            self.stop.append(accepting or not any(terminal[s] == NOT_TERMINAL for s in states))
+            self.size += DFA_STATE_COST + DFA_SET_ENTRY_COST * len(states)
+        return state
+
+    def start(self):
+        return self.intern(frozenset((self.nfa.start_state,)))
+
+    def transition(self, state, symbol):
+        """Computes the successor of a DFA state on a symbol and caches it, flushing the cache when it is full"""
+        nfa = self.nfa
+        successors = set()
+        for s in self.sets[state]:
+            if nfa.terminal[s] != NOT_TERMINAL:
+                continue
+            if s not in nfa.states:
+                raise Exception("Undefined state: " + nfa.state_names[s])
+            successors.update(nfa.states[s][2].get(symbol, ()))
+        successors = frozenset(successors)
+
+        cost = DFA_TRANSITION_COST
+        if successors not in self.ids:
+            cost += DFA_STATE_COST + DFA_SET_ENTRY_COST * len(successors)
+        if self.size + cost > self.memory_limit:
+            # The state being left is gone with the rest, so its row is not recorded
+            self.flushes += 1
+            self.clear()
+            return self.intern(successors)
+
+        successor = self.intern(successors)
+        self.rows[state][symbol] = successor
+        self.size += DFA_TRANSITION_COST
+        return successor
+
+    def name(self, state):
+        # NFA states in declaration order, such as {A,C}
+        return "{" + ",".join(self.nfa.state_names[s] for s in sorted(self.sets[state])) + "}"
+
+class LazyDFASimulator(AbstractMachineSimulator):
+    """Runs a nondeterministic finite acceptor written with SCAN through a LazyDFA.
+
+    It is used like AbstractMachineSimulator: current_state names the set of NFA states
+    the machine may be in, and each step reads one symbol. The run accepts as soon as the
+    set holds an accept state, and rejects when no state in it can read on, or when the
+    blanks past the end of the input lead back to a set already seen there. The DFA cache
+    is kept across inputs, so batches reuse the states earlier inputs built.
+    """
+
+    def __init__(self, machine_definition, memory_limit=8 * 1024 * 1024, state_map=None, compiled=None) -> None:
+        super().__init__(machine_definition, state_map=state_map, compiled=compiled)
+        nfa = NondeterministicSimulator(machine_definition)
+        error = scan_acceptor_error(nfa)
+        if error != None:
+            raise Exception(error)
+        self.dfa = LazyDFA(nfa, memory_limit=memory_limit)
+
+    def reset(self):
+        super().reset()
+        self.dfa_state = None
+        self.last_symbol = None
+        # DFA states met while reading the blanks past the input, and the flush they belong to
+        self.blank_states = set()
+        self.blank_flushes = None
+        self.input_end = None
+
+    def set_input_tape(self, input_tape, is_turing_machine=False):
+        super().set_input_tape(input_tape)
+        self.input_end = len(input_tape) - 1
+
+    def past_input_end(self):
+        if isinstance(self.input_tape, StreamingInputTape):
+            return self.input_tape.exhausted
+        return self.input_tape.head >= self.input_end
+
+    def reached_blank_cycle(self, state):
+        # Past the input every symbol is #, so a repeated DFA state there repeats forever
+        if self.blank_flushes != self.dfa.flushes:
+            self.blank_states.clear()
+            self.blank_flushes = self.dfa.flushes
+        if state in self.blank_states:
+            return True
+        self.blank_states.add(state)
+        return False
+
+    def execute(self, max_steps=None):
+        """Reads symbols through the DFA cache until the run stops. Returns the number of symbols read."""
+        if self.input_tape == None:
+            raise Exception("Input tape not set")
+        if self.halted:
+            return 0
+
+        dfa = self.dfa
+        state = self.dfa_state
+        if state == None or state >= len(dfa.sets):
+            state = dfa.start()
+        rows = dfa.rows
+        stop = dfa.stop
+        scan_right = self.input_tape.scan_right
+        budget = -1 if max_steps == None else max_steps
+        symbol = self.last_symbol
+
+        steps = 0
+        try:
+            while True:
+                if stop[state]:
+                    self.halted = True
+                    self.accepted = dfa.accepting[state]
+                    self.halt_reason = "accept" if self.accepted else "reject"
+                    break
+                if steps == budget:
+                    break
+                steps += 1
+
+                symbol = scan_right()
+                successor = rows[state].get(symbol)
+                if successor == None:
+                    successor = dfa.transition(state, symbol)
+                    # A flush replaces the tables
+                    rows = dfa.rows
+                    stop = dfa.stop
+                state = successor
+
+                if symbol == "#" and self.past_input_end() and self.reached_blank_cycle(state):
+                    self.halted = True
+                    self.halt_reason = "reject"
+                    break
+        finally:
+            self.dfa_state = state
+            self.last_symbol = symbol
+            self.current_state = dfa.name(state)
+            self.steps += steps
+
+        return steps
+
+    def step(self, verbose=False, logger=None) -> bool:
+        if self.input_tape == None:
+            raise Exception("Input tape not set")
+        if self.halted:
+            return False
+
+        if self.dfa_state == None:
+            self.log(EVENT_START, (self.dfa.name(self.dfa.start()),), verbose, logger)
+        if self.execute(max_steps=1) > 0:
+            self.log(EVENT_READ, (self.last_symbol,), verbose, logger)
+            self.log(EVENT_TRANSITION, (self.current_state,), verbose, logger)
+        if self.halted:
+            self.log(EVENT_ACCEPT if self.accepted else EVENT_REJECT, (), verbose, logger)
+            return False
@@ -0,0 +1,243 @@
+import os, sys, json, time, mmap, struct, hashlib, tempfile
+from array import array
+from collections.abc import Mapping
+from input_parser import InputParser
+from abstract_simulator import AbstractMachineSimulator
+from machine_compiler import CompiledMachine
+
+# Bump whenever the file layout or the compiled tables change, so old entries are never read
+CACHE_FORMAT_VERSION = 1
+CACHE_MAGIC = b"AMIC"
+CACHE_SUFFIX = ".amc"
+
+# magic, format version, byte order, state count, table width, start state + 1, then the metadata, logic and state map lengths
+header_format = struct.Struct("<4sIBIIIIII")
+
+def default_cache_directory():
+    return os.path.join(os.path.expanduser("~"), ".cache", "abstract-machine-interpreter")
+
+def source_key(source):
+    """Content address of an MDL source for the current cache format"""
+    return hashlib.sha256((str(CACHE_FORMAT_VERSION) + "\0" + source).encode("utf-8")).hexdigest()
+
+class LazyMapping(Mapping):
+    """Read-only mapping that is only decoded from its JSON text when first used"""
+
+    def __init__(self, text):
+        self.text = text
+        self.mapping = None
+
+    def load(self):
+        if self.mapping == None:
+            self.mapping = json.loads(self.text)
+            self.text = None
+        return self.mapping
+
+    def __getitem__(self, key):
+        return self.load()[key]
+
+    def __iter__(self):
+        return iter(self.load())
+
+    def __len__(self):
+        return len(self.load())
+
+def pack_machine(machine):
+    """Serializes a simulator's definition, state map and compiled tables.
+
+    The strings needed to run the machine go into a JSON metadata block, and the logic
+    and the state map into two more JSON blocks that are only decoded when used.
+    The integer tables follow as raw int32 arrays: opcodes, terminal flags, aux data
+    indices, next states and the dense transition table (one row of width entries per
+    state).
+    """
+    compiled = machine.compiled
+    count = len(compiled.state_names)
+    logic = json.dumps(dict(machine.logic), separators=(",", ":")).encode("utf-8")
+    state_map = json.dumps(dict(machine.state_map), separators=(",", ":")).encode("utf-8")
+    metadata = json.dumps({
+        "aux_data": machine.aux_data,
+        "state_names": compiled.state_names,
+        "symbols": compiled.symbols,
+        "memory_keys": compiled.memory_keys,
+        "rows": [compiled.table[state] != None for state in range(count)],
+        "writes": compiled.writes,
+        "emit": compiled.emit,
+        "errors": compiled.errors
+    }, separators=(",", ":")).encode("utf-8")
+
+    table = array("i")
+    for state in range(count):
+        table.extend(compiled.table[state] if compiled.table[state] != None else [0] * compiled.width)
+
+    start_state = compiled.start_state + 1 if compiled.start_state != None else 0
+    byte_order = 0 if sys.byteorder == "little" else 1
+    parts = [header_format.pack(CACHE_MAGIC, CACHE_FORMAT_VERSION, byte_order, count, compiled.width, start_state, len(metadata), len(logic), len(state_map)), metadata, logic, state_map]
+    for values in (compiled.opcodes, compiled.terminal, compiled.data, compiled.next_state):
+        parts.append(array("i", values).tobytes())
+    parts.append(table.tobytes())
+    return b"".join(parts)
+
+def unpack_machine(buffer):
+    """Rebuilds a simulator from the bytes written by pack_machine(), or returns None if they are not a valid entry"""
+    if len(buffer) < header_format.size:
+        return None
+    magic, version, byte_order, count, width, start_state, metadata_length, logic_length, state_map_length = header_format.unpack_from(buffer, 0)
+    if magic != CACHE_MAGIC or version != CACHE_FORMAT_VERSION:
+        return None
+    position = header_format.size
+    metadata = json.loads(bytes(buffer[position:position + metadata_length]).decode("utf-8"))
+    position += metadata_length
+    logic = LazyMapping(bytes(buffer[position:position + logic_length]))
+    position += logic_length
+    state_map = LazyMapping(bytes(buffer[position:position + state_map_length]))
+    position += state_map_length
+
+    swap = byte_order != (0 if sys.byteorder == "little" else 1)
+    tables = []
+    for length in (count, count, count, count, count * width):
+        values = array("i")
+        values.frombytes(buffer[position:position + length * values.itemsize])
+        if swap:
+            values.byteswap()
+        tables.append(values)
+        position += length * values.itemsize
+    if position != len(buffer):
+        return None
+    opcodes, terminal, data, next_state, table = tables
+
+    compiled = CompiledMachine.__new__(CompiledMachine)
+    compiled.state_names = metadata["state_names"]
+    compiled.state_ids = {name: i for i, name in enumerate(compiled.state_names)}
+    compiled.symbols = metadata["symbols"]
+    compiled.symbol_codes = {symbol: i for i, symbol in enumerate(compiled.symbols)}
+    compiled.memory_keys = metadata["memory_keys"]
+    compiled.memory_ids = {key: i for i, key in enumerate(compiled.memory_keys)}
+    compiled.unknown_code = len(compiled.symbols)
+    compiled.width = width
+    compiled.start_state = start_state - 1 if start_state > 0 else None
+    compiled.opcodes = opcodes.tolist()
+    compiled.terminal = terminal.tolist()
+    compiled.data = data.tolist()
+    compiled.next_state = next_state.tolist()
+    table = table.tolist()
+    rows = metadata["rows"]
+    compiled.table = [table[state * width:(state + 1) * width] if rows[state] else None for state in range(count)]
+    compiled.writes = metadata["writes"]
+    compiled.emit = metadata["emit"]
+    compiled.errors = metadata["errors"]
+
+    # The logic and state map are only needed for graphing and editing, not to run the machine
+    machine_definition = {"aux_data": metadata["aux_data"], "logic": logic}
+    return AbstractMachineSimulator(machine_definition, state_map=state_map, compiled=compiled)
+
+class MachineCache:
+    """Content-addressed on-disk cache of compiled machines.
+
+    Entries are keyed by the SHA-256 of the MDL source and the cache format version, and
+    are memory-mapped back on later loads, skipping parsing and compilation entirely.
+    Entries unused for longer than max_age seconds are evicted, then the least recently
+    used ones until the cache fits in max_size bytes.
+    """
+
+    def __init__(self, directory=None, max_size=64 * 1024 * 1024, max_age=30 * 24 * 60 * 60):
+        self.directory = directory or default_cache_directory()
+        self.max_size = max_size
+        self.max_age = max_age
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.directory, key + CACHE_SUFFIX)
+
+    def get(self, source):
+        """Returns a fresh simulator for the source if it is cached, otherwise None"""
+        path = self.path(source_key(source))
+        try:
+            with open(path, "rb") as file:
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer, memoryview(buffer) as view:
+                    machine = unpack_machine(view)
+        except OSError:
+            return None
+        except ValueError:
+            machine = None
+
+        if machine == None:
+            # Written by another format version, or truncated
+            self.remove(path)
+            return None
+
+        # The modification time doubles as the last use for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return machine
+
+    def put(self, source, machine):
+        data = pack_machine(machine)
+        # Write to a temporary file first so readers never see a partial entry
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temporary, self.path(source_key(source)))
+        except OSError:
+            self.remove(temporary)
+            raise
+        self.evict()
+
+    def load(self, source):
+        """Returns a simulator for the MDL source, parsing and caching it on a miss"""
+        machine = self.get(source)
+        if machine == None:
+            machine = AbstractMachineSimulator(InputParser(source).parse())
+            self.put(source, machine)
+        return machine
+
+    def entries(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith(CACHE_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for last_used, size, path in self.entries():
+            if self.max_age != None and now - last_used > self.max_age:
+                self.remove(path)
+            else:
+                entries.append((last_used, size, path))
+
+        if self.max_size != None:
+            # Oldest first
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in entries:
+                if total <= self.max_size:
+                    break
+                self.remove(path)
+                total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            self.remove(path)
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def load_machine(source, cache=None):
+    """Returns a simulator for the MDL source, going through the default cache unless another one is given"""
+    if cache == None:
+        cache = MachineCache()
+    return cache.load(source)
@@ -0,0 +1,214 @@
+# Instruction opcodes
+OP_SCAN = 0
+OP_SCAN_RIGHT = 1
+OP_SCAN_LEFT = 2
+OP_READ = 3
+OP_WRITE = 4
+OP_PRINT = 5
+OP_RIGHT = 6
+OP_LEFT = 7
+OP_ERROR = 8
+
+# Terminal flags
+NOT_TERMINAL = 0
+ACCEPT = 1
+REJECT = 2
+HALT = 3
+
+TERMINAL_STATES = {"accept": ACCEPT, "reject": REJECT, "halt": HALT}
+
+# Special transition table entries
+NO_TRANSITION = -1
+NONDETERMINISTIC = -2
+
+instruction_opcodes = {
+    "SCAN": OP_SCAN,
+    "SCAN RIGHT": OP_SCAN_RIGHT,
+    "SCAN LEFT": OP_SCAN_LEFT,
+    "READ": OP_READ,
+    "WRITE": OP_WRITE,
+    "PRINT": OP_PRINT,
+    "RIGHT": OP_RIGHT,
+    "LEFT": OP_LEFT
+}
+
+class CompiledMachine:
+    """Integer-indexed transition tables built from a simulator state map"""
+
+    def __init__(self, state_map, aux_data):
+        self.state_names = []
+        self.state_ids = {}
+        self.symbols = []
+        self.symbol_codes = {}
+        self.memory_keys = list(aux_data.keys())
+        self.memory_ids = {key: i for i, key in enumerate(self.memory_keys)}
+
+        # Number the declared states first, then the referenced ones
+        for name in state_map.keys():
+            self.intern_state(name)
+        for name in state_map.keys():
+            self.intern_transitions(state_map[name])
+
+        # The last column of every row is for symbols the machine never reads
+        self.unknown_code = len(self.symbols)
+        self.width = self.unknown_code + 1
+        self.start_state = 0 if len(state_map) > 0 else None
+
+        count = len(self.state_names)
+        self.opcodes = [OP_ERROR] * count
+        self.terminal = [NOT_TERMINAL] * count
+        self.data = [-1] * count
+        self.table = [None] * count
+        self.writes = [None] * count
+        self.next_state = [NO_TRANSITION] * count
+        self.emit = [None] * count
+        self.errors = [None] * count
+
+        for state in range(count):
+            name = self.state_names[state]
+            self.terminal[state] = TERMINAL_STATES.get(name.lower(), NOT_TERMINAL)
+            if name in state_map:
+                self.compile_state(state, state_map[name], aux_data)
+            else:
+                self.errors[state] = "Undefined state: " + name
+
+    def update(self, state_map, aux_data, changes):
+        """Recompiles only the named states after they were added, changed or removed.
+
+        New states and symbols are numbered after the existing ones, so the rows of the
+        other states stay valid. Removed states become undefined, like any other state
+        that is referenced but not declared.
+        """
+        for name in changes:
+            self.intern_state(name)
+            if name in state_map:
+                self.intern_transitions(state_map[name])
+
+        # New symbols take over the unknown column, which is empty in every row
+        width = len(self.symbols) + 1
+        if width != self.width:
+            padding = width - self.width
+            for state in range(len(self.table)):
+                if self.table[state] != None:
+                    self.table[state].extend([NO_TRANSITION] * padding)
+                if self.writes[state] != None:
+                    self.writes[state].extend([None] * padding)
+            self.unknown_code = len(self.symbols)
+            self.width = width
+
+        for state in range(len(self.opcodes), len(self.state_names)):
+            name = self.state_names[state]
+            self.opcodes.append(OP_ERROR)
+            self.terminal.append(TERMINAL_STATES.get(name.lower(), NOT_TERMINAL))
+            self.data.append(-1)
+            self.table.append(None)
+            self.writes.append(None)
+            self.next_state.append(NO_TRANSITION)
+            self.emit.append(None)
+            self.errors.append("Undefined state: " + name)
+
+        for name in changes:
+            state = self.state_ids[name]
+            if name in state_map:
+                self.compile_state(state, state_map[name], aux_data)
+            else:
+                self.clear_state(state)
+                self.errors[state] = "Undefined state: " + name
+
+        self.start_state = self.state_ids[next(iter(state_map))] if len(state_map) > 0 else None
+
+    def intern_state(self, name):
+        if name not in self.state_ids:
+            self.state_ids[name] = len(self.state_names)
+            self.state_names.append(name)
+        return self.state_ids[name]
+
+    def intern_symbol(self, symbol):
+        if symbol not in self.symbol_codes:
+            self.symbol_codes[symbol] = len(self.symbols)
+            self.symbols.append(symbol)
+        return self.symbol_codes[symbol]
+
+    def intern_transitions(self, entry):
+        instruction = entry["instruction"]
+        for symbol, destination in entry["transitions"].items():
+            self.intern_state(destination)
+            if instruction in ("RIGHT", "LEFT"):
+                self.intern_symbol(symbol.split("/")[0])
+            elif instruction not in ("WRITE", "PRINT"):
+                self.intern_symbol(symbol)
+
+    def clear_state(self, state):
+        self.opcodes[state] = OP_ERROR
+        self.data[state] = -1
+        self.table[state] = None
+        self.writes[state] = None
+        self.next_state[state] = NO_TRANSITION
+        self.emit[state] = None
+        self.errors[state] = None
+
+    def compile_state(self, state, entry, aux_data):
+        self.clear_state(state)
+        instruction = entry["instruction"]
+        associated_data = entry["associated_data"]
+        transitions = entry["transitions"]
+
+        opcode = instruction_opcodes.get(instruction)
+        if opcode == None:
+            self.errors[state] = "Instruction not supported."
+            return
+
+        # Resolve the associated aux data
+        data_type = None
+        if opcode in (OP_READ, OP_WRITE, OP_RIGHT, OP_LEFT):
+            if associated_data == None:
+                self.errors[state] = instruction + " instruction requires associated data"
+                return
+            if associated_data not in self.memory_ids:
+                self.errors[state] = "Unknown aux data: " + associated_data
+                return
+            self.data[state] = self.memory_ids[associated_data]
+            data_type = aux_data[associated_data]["type"]
+
+        if opcode in (OP_READ, OP_WRITE) and data_type == "TAPE":
+            self.errors[state] = "Tape is not a valid data type for " + instruction + " instruction"
+            return
+        if opcode in (OP_RIGHT, OP_LEFT) and data_type != "TAPE":
+            self.errors[state] = "Associated data must be a tape"
+            return
+
+        if opcode in (OP_WRITE, OP_PRINT):
+            # Single transition: the symbol is emitted, then the machine moves on
+            if len(transitions) > 1:
+                self.errors[state] = instruction + " instruction can only have one transition."
+                return
+            if len(transitions) == 0:
+                self.errors[state] = instruction + " instruction requires a transition."
+                return
+            symbol = list(transitions.keys())[0]
+            self.emit[state] = symbol
+            self.next_state[state] = self.state_ids[transitions[symbol]]
+        elif opcode in (OP_RIGHT, OP_LEFT):
+            # Keys are read/write pairs; two pairs reading the same symbol are non-deterministic
+            row = [NO_TRANSITION] * self.width
+            writes = [None] * self.width
+            for key, destination in transitions.items():
+                pair = key.split("/")
+                if len(pair) < 2:
+                    self.errors[state] = instruction + " transitions must be of the form <read>/<write>: " + key
+                    return
+                code = self.symbol_codes[pair[0]]
+                if row[code] != NO_TRANSITION:
+                    row[code] = NONDETERMINISTIC
+                else:
+                    row[code] = self.state_ids[destination]
+                    writes[code] = pair[1]
+            self.table[state] = row
+            self.writes[state] = writes
+        else:
+            row = [NO_TRANSITION] * self.width
+            for symbol, destination in transitions.items():
+                row[self.symbol_codes[symbol]] = self.state_ids[destination]
+            self.table[state] = row
+
+        self.opcodes[state] = opcode
@@ -0,0 +1,182 @@
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from aux_data_structures import InputTape, copy_structure
+from machine_compiler import OP_SCAN_LEFT
+
+def snapshot_size(snapshot):
+    # Bytes of the buffers a snapshot holds; the shared input tape cells are not counted
+    size = 0
+    for memory in snapshot["memory"].values():
+        for cls in type(memory).__mro__:
+            for slot in getattr(cls, "__slots__", ()):
+                value = getattr(memory, slot)
+                if isinstance(value, array):
+                    size += value.itemsize * len(value)
+    return size
+
+def common_prefix_length(a, b):
+    # Binary search over slice comparisons, which run at memcmp speed
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if a[:middle] == b[:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+def prefix_resumable(machine):
+    """Whether everything up to a configuration of the machine depends only on the input up to its head"""
+    if type(machine.input_tape) is not InputTape or machine.input_string == None or machine.output_sink != None:
+        return False
+    # A Turing machine writes its input tape, and scanning left reads symbols again
+    for memory in machine.memory.values():
+        if memory is machine.input_tape:
+            return False
+    return OP_SCAN_LEFT not in machine.compiled.opcodes
+
+class PrefixCache:
+    """Configurations reached by earlier runs, for resuming a run on an edited input"""
+
+    def __init__(self, max_entries=256, memory_limit=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.memory_limit = memory_limit
+        self.clear()
+
+    def clear(self):
+        # The configurations belong to one machine, so this has to be called when it changes
+        # (input string, head) -> (snapshot, output list of the run), least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def add(self, machine, snapshot):
+        # A run that only moved right over an unwritten input has read it no further than its head
+        if not prefix_resumable(machine):
+            return
+        head = snapshot["input_tape"].head
+        # Past the end of the string the head has read blanks the string does not hold
+        if head >= len(machine.input_string):
+            return
+        key = (machine.input_string, head)
+        if key in self.entries:
+            # The later configuration at the same head saves more steps
+            self.size -= snapshot_size(self.entries.pop(key)[0])
+        self.entries[key] = (snapshot, machine.output)
+        self.size += snapshot_size(snapshot)
+        # Evict the least recently used entries past max_entries or memory_limit
+        while len(self.entries) > self.max_entries or (len(self.entries) > 1 and self.size > self.memory_limit):
+            self.size -= snapshot_size(self.entries.popitem(last=False)[1][0])
+
+    def resume(self, machine, input_tape, is_turing_machine=False):
+        """Sets the input tape, resumes the furthest cached run over a prefix of it and returns its snapshots from step zero"""
+        machine.set_input_tape(input_tape, is_turing_machine=is_turing_machine)
+        if machine.steps != 0 or not prefix_resumable(machine):
+            return []
+
+        # Length of the prefix the new input shares with each earlier one
+        shared = {}
+        best = None
+        for key, (snapshot, _) in self.entries.items():
+            previous, head = key
+            if previous not in shared:
+                shared[previous] = common_prefix_length(previous, input_tape)
+            if head < shared[previous] and (best == None or snapshot["steps"] > self.entries[best][0]["steps"]):
+                best = key
+        if best == None or self.entries[best][0]["steps"] == 0:
+            return []
+        self.entries.move_to_end(best)
+        previous = best[0]
+        snapshot, output = self.entries[best]
+
+        # The earlier run's configurations over the shared prefix, with the new input under the head
+        snapshots = [machine.snapshot()]
+        earlier = [entry for (string, head), (entry, _) in self.entries.items() if string == previous and head < shared[previous]]
+        for entry in sorted(earlier, key=lambda entry: entry["steps"]):
+            if entry["steps"] > 0:
+                tape = copy_structure(machine.input_tape, share_buffers=True)
+                tape.head = entry["input_tape"].head
+                snapshots.append(dict(entry, input_tape=tape))
+        machine.output = output[:snapshot["output"]]
+        machine.restore(snapshots[-1])
+        return snapshots
+
+class MachineHistory:
+    """Checkpoints of a machine's run, taken as it steps through execute() and step(), for stepping back"""
+
+    def __init__(self, machine, interval=4096, max_checkpoints=256, memory_limit=64 * 1024 * 1024, prefix_cache=None, checkpoints=()):
+        self.machine = machine
+        self.interval = interval
+        self.max_checkpoints = max_checkpoints
+        self.memory_limit = memory_limit
+        # Each checkpoint is also handed to the prefix cache, when there is one
+        self.prefix_cache = prefix_cache
+        # Step counts of the checkpoints in ascending order, and the snapshots themselves
+        self.steps = []
+        self.checkpoints = []
+        self.size = 0
+        # A resumed run starts with the snapshots PrefixCache.resume() returned
+        for snapshot in checkpoints:
+            self.steps.append(snapshot["steps"])
+            self.checkpoints.append(snapshot)
+            self.size += snapshot_size(snapshot)
+        self.record()
+
+    def record(self):
+        machine = self.machine
+        if len(self.steps) > 0 and machine.steps < self.steps[-1] + self.interval:
+            return
+        snapshot = machine.snapshot()
+        self.steps.append(machine.steps)
+        self.checkpoints.append(snapshot)
+        self.size += snapshot_size(snapshot)
+        if self.prefix_cache != None:
+            self.prefix_cache.add(machine, snapshot)
+        # Past max_checkpoints or memory_limit every other one is dropped and the interval doubles
+        while len(self.steps) > 1 and (len(self.steps) > self.max_checkpoints or self.size > self.memory_limit):
+            self.thin()
+
+    def thin(self):
+        self.steps = self.steps[::2]
+        self.checkpoints = self.checkpoints[::2]
+        self.size = sum(snapshot_size(snapshot) for snapshot in self.checkpoints)
+        self.interval *= 2
+
+    def execute(self, max_steps=None):
+        """Runs the machine like its execute(), stopping on checkpoint boundaries to take them"""
+        machine = self.machine
+        executed = 0
+        while not machine.halted and executed != max_steps:
+            boundary = self.steps[-1] + self.interval
+            quantum = boundary - machine.steps if machine.steps < boundary else self.interval
+            if max_steps != None:
+                quantum = min(quantum, max_steps - executed)
+            count = machine.execute(quantum)
+            executed += count
+            self.record()
+            if count < quantum:
+                break
+        return executed
+
+    def step(self, verbose=False, logger=None):
+        result = self.machine.step(verbose=verbose, logger=logger)
+        self.record()
+        return result
+
+    def seek(self, target):
+        """Puts the machine in the configuration it had after target steps"""
+        machine = self.machine
+        # Before the first checkpoint there is nothing to replay from
+        target = max(self.steps[0], target)
+        if target >= machine.steps:
+            # Ahead of the machine, so it only has to run on
+            self.execute(target - machine.steps)
+            return
+        # The machine is deterministic, so replaying from the nearest checkpoint costs at most interval steps
+        index = max(0, bisect_right(self.steps, target) - 1)
+        machine.restore(self.checkpoints[index])
+        if target > machine.steps:
+            machine.execute(target - machine.steps)
+
+    def step_back(self, count=1):
+        self.seek(self.machine.steps - count)
@@ -0,0 +1,147 @@
+from machine_compiler import TERMINAL_STATES, ACCEPT
+
+# Instructions that only ever move the input tape head to the right
+forward_scan_instructions = ("SCAN", "SCAN RIGHT")
+
+# Sentinels for the completed DFA
+DEAD = object()
+ACCEPTED = object()
+OTHER_SYMBOL = object()
+
+def parse_arguments(arguments):
+    transitions = {}
+    for t in arguments:
+        t = t.split(",")
+        transitions[t[0][1:]] = t[1][:-1]
+    return transitions
+
+def is_scan_only(logic):
+    if len(logic) == 0:
+        return False
+    for key in logic.keys():
+        if logic[key]["instruction"] not in forward_scan_instructions:
+            return False
+    return True
+
+def minimize_scan_machine(logic):
+    """Minimizes a machine made only of SCAN / SCAN RIGHT states with Hopcroft's algorithm.
+
+    Missing transitions, reject and halt all lead to an implicit dead state, so states that
+    can never reach accept are merged into it and transitions into it are dropped. The
+    returned logic dictionary accepts exactly the same input tapes. The original logic is
+    returned unchanged when the machine cannot be minimized safely (its start state is a
+    terminal state, or it refers to states that are not defined).
+    """
+    if not is_scan_only(logic):
+        raise Exception("Only machines made of SCAN states can be minimized")
+
+    names = list(logic.keys())
+    start = names[0]
+    if start.lower() in TERMINAL_STATES:
+        return logic
+
+    # Collect the reachable states and complete the transition function
+    accept_name = None
+    transitions = {}
+    alphabet = []
+    pending = [start]
+    while len(pending) > 0:
+        state = pending.pop()
+        if state in transitions:
+            continue
+        transitions[state] = {}
+        for symbol, destination in parse_arguments(logic[state]["arguments"]).items():
+            if symbol not in alphabet:
+                alphabet.append(symbol)
+            terminal = TERMINAL_STATES.get(destination.lower())
+            if terminal == ACCEPT:
+                accept_name = accept_name or destination
+                transitions[state][symbol] = ACCEPTED
+            elif terminal != None:
+                transitions[state][symbol] = DEAD
+            elif destination in logic:
+                transitions[state][symbol] = destination
+                pending.append(destination)
+            else:
+                return logic
+    alphabet.append(OTHER_SYMBOL)
+
+    states = [name for name in names if name in transitions] + [ACCEPTED, DEAD]
+    delta = {state: transitions[state] for state in transitions}
+    delta[ACCEPTED] = {symbol: ACCEPTED for symbol in alphabet}
+    delta[DEAD] = {}
+
+    # Inverse transition function, symbol -> destination -> sources
+    inverse = {symbol: {} for symbol in alphabet}
+    for state in states:
+        for symbol in alphabet:
+            destination = delta[state].get(symbol, DEAD)
+            inverse[symbol].setdefault(destination, []).append(state)
+
+    # Hopcroft partition refinement, starting from {accept} and everything else
+    blocks = [{ACCEPTED}, set(states) - {ACCEPTED}]
+    block_of = {state: 1 for state in states}
+    block_of[ACCEPTED] = 0
+    waiting = [0]
+    in_waiting = {0}
+    while len(waiting) > 0:
+        splitter = waiting.pop()
+        in_waiting.discard(splitter)
+        splitter_states = list(blocks[splitter])
+        for symbol in alphabet:
+            # Group the predecessors by their current block
+            touched = {}
+            for destination in splitter_states:
+                for source in inverse[symbol].get(destination, ()):
+                    touched.setdefault(block_of[source], set()).add(source)
+
+            for block, members in touched.items():
+                if len(members) == len(blocks[block]):
+                    continue
+                blocks[block] -= members
+                new_block = len(blocks)
+                blocks.append(members)
+                for state in members:
+                    block_of[state] = new_block
+                if block in in_waiting or len(members) <= len(blocks[block]):
+                    waiting.append(new_block)
+                    in_waiting.add(new_block)
+                else:
+                    waiting.append(block)
+                    in_waiting.add(block)
+
+    # Each block is named after its first declared member
+    representative = {}
+    for state in states:
+        if block_of[state] not in representative:
+            representative[block_of[state]] = state
+    dead_block = block_of[DEAD]
+
+    minimized = {}
+    for state in states:
+        if state is ACCEPTED or state is DEAD or representative[block_of[state]] != state:
+            continue
+        if state != start and block_of[state] == dead_block:
+            continue
+        arguments = []
+        for symbol, destination in transitions[state].items():
+            if block_of[destination] == dead_block:
+                continue
+            if destination is ACCEPTED:
+                destination = accept_name
+            else:
+                destination = representative[block_of[destination]]
+            arguments.append("(" + symbol + "," + destination + ")")
+        minimized[state] = dict(logic[state])
+        minimized[state]["arguments"] = arguments
+
+    return minimized
+
+def optimize_machine_definition(machine_definition):
+    """Returns an equivalent machine definition, minimizing SCAN-only machines"""
+    if not is_scan_only(machine_definition["logic"]):
+        return machine_definition
+    return {
+        "aux_data": machine_definition["aux_data"],
+        "logic": minimize_scan_machine(machine_definition["logic"])
+    }
@@ -0,0 +1,359 @@
+import time
+from collections import deque
+from abstract_simulator import RunResult, associated_data_pattern
+from aux_data_structures import intern_symbol, FINGERPRINT_MODULUS, FINGERPRINT_BASE, FINGERPRINT_INVERSE
+from machine_compiler import instruction_opcodes, TERMINAL_STATES, NOT_TERMINAL, ACCEPT, OP_SCAN, OP_SCAN_RIGHT, OP_SCAN_LEFT, OP_READ, OP_WRITE, OP_PRINT, OP_RIGHT, OP_LEFT
+
+# Number of configurations expanded between wall-clock checks
+DEADLINE_CHECK_INTERVAL = 1024
+
+class ConsCell:
+    """Immutable list cell. Cells are hash-consed, so equal lists are the same object."""
+    __slots__ = ("symbol", "rest")
+
+    def __init__(self, symbol, rest):
+        self.symbol = symbol
+        self.rest = rest
+
+class ConsQueue:
+    """Persistent queue of a front list and a reversed back list, compared by its contents"""
+    __slots__ = ("front", "back", "size", "hash", "power")
+
+    def __init__(self, front, back, size, hash, power):
+        self.front = front
+        self.back = back
+        self.size = size
+        # Element i from the front with code c contributes (c + 1) * BASE^i, and power is BASE^size
+        self.hash = hash
+        self.power = power
+
+    def symbols(self):
+        symbols = []
+        cell = self.front
+        while cell != None:
+            symbols.append(cell.symbol)
+            cell = cell.rest
+        back = []
+        cell = self.back
+        while cell != None:
+            back.append(cell.symbol)
+            cell = cell.rest
+        return symbols + back[::-1]
+
+    def __eq__(self, other):
+        if self.size != other.size or self.hash != other.hash:
+            return False
+        if self.front is other.front and self.back is other.back:
+            return True
+        # The same contents can be split between the two lists differently
+        return self.symbols() == other.symbols()
+
+    def __hash__(self):
+        return self.hash
+
+EMPTY_QUEUE = ConsQueue(None, None, 0, 0, 1)
+
+class NondeterministicSimulator:
+    """Breadth-first simulator for nondeterministic machines (NFA, NPDA and NTM).
+
+    Every transition of a state is followed, including several on the same symbol, and
+    WRITE or PRINT states with more than one transition branch on the symbol they emit.
+    A configuration is a tuple of the state, the input head and the memory. Stacks are
+    hash-consed lists (top first), queues are ConsQueues of two of them and tapes are
+    zippers of two of them, so a branch shares all unchanged memory with its parent. A
+    visited set of configurations makes exploration cost proportional to the number of
+    distinct configurations instead of the number of paths.
+
+    The search stops at the first accepting configuration, which is therefore reached by
+    a shortest path. Its RunResult counts the configurations expanded as steps.
+    """
+
+    def __init__(self, machine_definition):
+        self.logic = machine_definition["logic"]
+        self.aux_data = machine_definition["aux_data"]
+        self.memory_keys = list(self.aux_data.keys())
+        self.memory_types = [self.aux_data[key]["type"] for key in self.memory_keys]
+
+        self.state_names = []
+        self.state_ids = {}
+        for name in self.logic.keys():
+            self.intern_state(name)
+        self.states = {}
+        for name in self.logic.keys():
+            self.states[self.state_ids[name]] = self.build_state(self.logic[name])
+        self.start_state = 0 if len(self.logic) > 0 else None
+        self.terminal = [TERMINAL_STATES.get(name.lower(), NOT_TERMINAL) for name in self.state_names]
+        self.scans_left = any(opcode == OP_SCAN_LEFT for opcode, _, _ in self.states.values())
+
+        self.reset()
+
+    def intern_state(self, name):
+        if name not in self.state_ids:
+            self.state_ids[name] = len(self.state_names)
+            self.state_names.append(name)
+        return self.state_ids[name]
+
+    def build_state(self, entry):
+        """Returns (opcode, memory slot, choices) for a logic entry, or (None, None, error)"""
+        instruction = entry["instruction"]
+        associated_data = None
+        data = associated_data_pattern.findall(instruction)
+        if len(data) > 0:
+            associated_data = data[0][1:-1]
+            instruction = instruction.replace("(" + associated_data + ")", "")
+
+        opcode = instruction_opcodes.get(instruction)
+        if opcode == None:
+            return (None, None, "Instruction not supported.")
+
+        slot = None
+        if opcode in (OP_READ, OP_WRITE, OP_RIGHT, OP_LEFT):
+            if associated_data == None:
+                return (None, None, instruction + " instruction requires associated data")
+            if associated_data not in self.aux_data:
+                return (None, None, "Unknown aux data: " + associated_data)
+            slot = self.memory_keys.index(associated_data)
+            data_type = self.memory_types[slot]
+            if opcode in (OP_READ, OP_WRITE) and data_type == "TAPE":
+                return (None, None, "Tape is not a valid data type for " + instruction + " instruction")
+            if opcode in (OP_RIGHT, OP_LEFT) and data_type != "TAPE":
+                return (None, None, "Associated data must be a tape")
+
+        # Unlike the state map, every transition is kept, even several on the same symbol
+        if opcode in (OP_WRITE, OP_PRINT):
+            choices = []
+        else:
+            choices = {}
+        for t in entry["arguments"]:
+            t = t.split(",")
+            symbol, destination = t[0][1:], self.intern_state(t[1][:-1])
+            if opcode in (OP_WRITE, OP_PRINT):
+                choices.append((symbol, destination))
+            elif opcode in (OP_RIGHT, OP_LEFT):
+                pair = symbol.split("/")
+                if len(pair) < 2:
+                    return (None, None, instruction + " transitions must be of the form <read>/<write>: " + symbol)
+                choices.setdefault(pair[0], []).append((pair[1], destination))
+            else:
+                choices.setdefault(symbol, []).append(destination)
+        if opcode in (OP_WRITE, OP_PRINT) and len(choices) == 0:
+            return (None, None, instruction + " instruction requires a transition.")
+        return (opcode, slot, choices)
+
+    def reset(self):
+        # Hash-cons tables, rebuilt for every run so memory is released between inputs
+        self.cells = {}
+        self.configurations = 0
+
+    def cons(self, symbol, rest):
+        key = (symbol, rest)
+        cell = self.cells.get(key)
+        if cell == None:
+            cell = ConsCell(symbol, rest)
+            self.cells[key] = cell
+        return cell
+
+    def enqueue(self, queue, symbol):
+        code = intern_symbol(symbol) + 1
+        return ConsQueue(queue.front, self.cons(symbol, queue.back), queue.size + 1,
+            (queue.hash + code * queue.power) % FINGERPRINT_MODULUS, queue.power * FINGERPRINT_BASE % FINGERPRINT_MODULUS)
+
+    def dequeue(self, queue):
+        """Returns the front symbol of a non-empty queue and the queue without it"""
+        front, back = queue.front, queue.back
+        if front == None:
+            # The back list is only reversed into the front once the front runs out
+            while back != None:
+                front = self.cons(back.symbol, front)
+                back = back.rest
+        code = intern_symbol(front.symbol) + 1
+        return front.symbol, ConsQueue(front.rest, back, queue.size - 1,
+            (queue.hash - code) * FINGERPRINT_INVERSE % FINGERPRINT_MODULUS, queue.power * FINGERPRINT_INVERSE % FINGERPRINT_MODULUS)
+
+    def cells_of(self, symbols):
+        result = None
+        for symbol in reversed(symbols):
+            result = self.cons(symbol, result)
+        return result
+
+    # Tapes are (left, right, overhang) zippers. left holds the cells left of the head,
+    # nearest first; right holds the head cell and the cells after it without trailing
+    # blanks, so a blank head cell at the end is None. overhang counts how far the head is
+    # left of the first cell, where reads fail like they do on a Tape.
+
+    def tape_right(self, symbol, rest):
+        if symbol == "#" and rest == None:
+            return None
+        return self.cons(symbol, rest)
+
+    def tape_from(self, input_string):
+        return (None, self.tape_right(input_string[0], self.cells_of(input_string[1:].rstrip("#"))), 0)
+
+    def tape_read(self, tape):
+        left, right, overhang = tape
+        if overhang > 0:
+            return None
+        return "#" if right == None else right.symbol
+
+    def tape_move(self, tape, direction):
+        left, right, overhang = tape
+        if direction == "R":
+            if overhang > 0:
+                return (left, right, overhang - 1)
+            if right == None:
+                return (self.cons("#", left), None, 0)
+            return (self.cons(right.symbol, left), right.rest, 0)
+        if overhang > 0 or left == None:
+            return (None, right, overhang + 1)
+        return (left.rest, self.tape_right(left.symbol, right), 0)
+
+    def tape_write(self, tape, symbol):
+        left, right, overhang = tape
+        if overhang > 0:
+            # Writing left of the first cell creates it, with blank cells up to the old first cell
+            for _ in range(overhang - 1):
+                right = self.tape_right("#", right)
+            return (None, self.tape_right(symbol, right), 0)
+        return (left, self.tape_right(symbol, right.rest if right != None else None), 0)
+
+    def start(self, input_tape, is_turing_machine=False):
+        if not isinstance(input_tape, str):
+            raise Exception("Input tape must be a string")
+        if input_tape[0] != "#" or input_tape[-1] != "#":
+            raise Exception("Input tape must start and end with #")
+        if self.start_state == None:
+            raise Exception("Machine has no states")
+
+        self.input_string = input_tape
+        # In a Turing machine the first declared tape holds the input, and SCAN moves its head
+        self.input_slot = None
+        memory = []
+        for slot in range(len(self.memory_keys)):
+            if self.memory_types[slot] == "TAPE":
+                if is_turing_machine and self.input_slot == None:
+                    self.input_slot = slot
+                    memory.append(self.tape_from(input_tape))
+                else:
+                    memory.append((None, None, 0))
+            elif self.memory_types[slot] == "STACK":
+                memory.append(None)
+            elif self.memory_types[slot] == "QUEUE":
+                memory.append(EMPTY_QUEUE)
+            else:
+                raise Exception("Unknown aux data type: " + self.memory_types[slot])
+        return (self.start_state, 0, tuple(memory))
+
+    def successors(self, configuration):
+        """Yields (configuration, printed symbol or None) for every transition out of a configuration"""
+        state, head, memory = configuration
+        if state not in self.states:
+            raise Exception("Undefined state: " + self.state_names[state])
+        opcode, slot, choices = self.states[state]
+        if opcode == None:
+            raise Exception(choices)
+
+        if opcode in (OP_SCAN, OP_SCAN_RIGHT, OP_SCAN_LEFT):
+            direction = "L" if opcode == OP_SCAN_LEFT else "R"
+            if self.input_slot == None:
+                head += 1 if direction == "R" else -1
+                if head > len(self.input_string) and not self.scans_left:
+                    # Every cell past the input is blank, and the head never comes back
+                    head = len(self.input_string)
+                if head < 0:
+                    symbol = None
+                else:
+                    symbol = self.input_string[head] if head < len(self.input_string) else "#"
+            else:
+                tape = self.tape_move(memory[self.input_slot], direction)
+                symbol = self.tape_read(tape)
+                memory = memory[:self.input_slot] + (tape,) + memory[self.input_slot + 1:]
+            for destination in choices.get(symbol, ()):
+                yield (destination, head, memory), None
+
+        elif opcode == OP_READ:
+            if self.memory_types[slot] == "STACK":
+                cell = memory[slot]
+                if cell == None:
+                    return
+                symbol, rest = cell.symbol, cell.rest
+            else:
+                if memory[slot].size == 0:
+                    return
+                symbol, rest = self.dequeue(memory[slot])
+            memory = memory[:slot] + (rest,) + memory[slot + 1:]
+            for destination in choices.get(symbol, ()):
+                yield (destination, head, memory), None
+
+        elif opcode == OP_WRITE:
+            for symbol, destination in choices:
+                if self.memory_types[slot] == "STACK":
+                    written = self.cons(symbol, memory[slot])
+                else:
+                    written = self.enqueue(memory[slot], symbol)
+                yield (destination, head, memory[:slot] + (written,) + memory[slot + 1:]), None
+
+        elif opcode == OP_PRINT:
+            for symbol, destination in choices:
+                yield (destination, head, memory), symbol
+
+        else:
+            tape = self.tape_move(memory[slot], "R" if opcode == OP_RIGHT else "L")
+            for write, destination in choices.get(self.tape_read(tape), ()):
+                yield (destination, head, memory[:slot] + (self.tape_write(tape, write),) + memory[slot + 1:]), None
+
+    def run(self, input_tape, is_turing_machine=False, max_steps=None, timeout=None) -> RunResult:
+        """Explores the machine breadth-first until a branch accepts, every branch halts,
+        max_steps configurations have been expanded or timeout seconds have passed"""
+        self.reset()
+        start = self.start(input_tape, is_turing_machine=is_turing_machine)
+        deadline = None if timeout == None else time.monotonic() + timeout
+
+        # Printed output is kept per branch as a shared list, newest symbol first
+        frontier = deque([(start, None)])
+        visited = {start}
+        expanded = 0
+        halt_reason = "reject"
+        while len(frontier) > 0:
+            configuration, output = frontier.popleft()
+            terminal = self.terminal[configuration[0]]
+            if terminal == ACCEPT:
+                self.configurations = len(visited)
+                return RunResult(True, "accept", expanded, self.output_of(output))
+            elif terminal != NOT_TERMINAL:
+                # This branch rejected or halted; the others carry on
+                continue
+
+            if expanded == max_steps:
+                halt_reason = "max_steps"
+                break
+            if deadline != None and expanded % DEADLINE_CHECK_INTERVAL == 0 and time.monotonic() >= deadline:
+                halt_reason = "timeout"
+                break
+            expanded += 1
+
+            for successor, symbol in self.successors(configuration):
+                if successor not in visited:
+                    visited.add(successor)
+                    frontier.append((successor, output if symbol == None else self.cons(symbol, output)))
+
+        self.configurations = len(visited)
+        return RunResult(False, halt_reason, expanded, "")
+
+    def output_of(self, cell):
+        symbols = []
+        while cell != None:
+            symbols.append(cell.symbol)
+            cell = cell.rest
+        return "".join(reversed(symbols))
+
+    def iter_batch(self, inputs, is_turing_machine=False, max_steps=None, timeout=None):
+        """Explores the machine on every input tape in turn, yielding a RunResult per input"""
+        for input_tape in inputs:
+            try:
+                yield self.run(input_tape, is_turing_machine=is_turing_machine, max_steps=max_steps, timeout=timeout)
+            except Exception as e:
+                yield RunResult(False, "error", 0, "", error=str(e))
+
+    def run_batch(self, inputs, is_turing_machine=False, max_steps=None, timeout=None):
+        """Explores the machine on every input tape and returns the list of RunResults in input order"""
+        return list(self.iter_batch(inputs, is_turing_machine=is_turing_machine, max_steps=max_steps, timeout=timeout))
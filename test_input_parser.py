@@ -0,0 +1,75 @@
+from input_parser import InputParser
+from abstract_simulator import AbstractMachineSimulator
+
+SOURCE = """.DATA
+STACK S1
+QUEUE Q1
+
+.LOGIC
+A] SCAN (a,B), (b,C)
+B] WRITE(S1) (x,A)
+C] WRITE(Q1) (y,D)
+D] SCAN (#,accept), (a,A)
+"""
+
+def edit(lines, line_edits):
+    lines = list(lines)
+    for index, line in line_edits:
+        if line == None:
+            del lines[index]
+        else:
+            lines.insert(index, line)
+    return "\n".join(lines)
+
+def check_update(parser, machine, source):
+    try:
+        fresh = InputParser(source).parse()
+    except SyntaxError as e:
+        try:
+            parser.update(source)
+        except SyntaxError as error:
+            assert str(error) == str(e)
+            return
+        raise Exception("update() accepted a source that parse() rejects")
+    changes = parser.update(source)
+    machine.apply_changes(*changes)
+    # Same definitions in the same declaration order, which decides the start state
+    assert parser.result == fresh
+    assert list(parser.result["logic"].keys()) == list(fresh["logic"].keys())
+    assert list(parser.result["aux_data"].keys()) == list(fresh["aux_data"].keys())
+    assert machine.state_map == AbstractMachineSimulator(fresh).state_map
+
+def test_update_matches_parse():
+    lines = SOURCE.strip().splitlines()
+    edits = [
+        # Inserted, deleted and rewritten states
+        [(6, "E] SCAN (b,accept)")],
+        [(7, None)],
+        [(5, None), (5, "A] SCAN (a,D), (b,C)")],
+        [(8, "A2] SCAN (a,A)")],
+        # Inserted and deleted data structures
+        [(2, "STACK S2")],
+        [(1, None)],
+        # A state moved before the others becomes the start state
+        [(8, None), (5, "D] SCAN (#,accept), (a,A)")],
+        # The whole .DATA section moved after .LOGIC
+        [(0, None), (0, None), (0, None), (0, None), (5, ""), (6, ".DATA"), (7, "STACK S1"), (8, "QUEUE Q1")],
+        # A state moved into the .DATA section, then a blank line there
+        [(8, None), (1, "D] SCAN (#,accept), (a,A)")],
+        [(3, "")],
+    ]
+    for line_edits in edits:
+        parser = InputParser(SOURCE)
+        machine = AbstractMachineSimulator(parser.parse())
+        check_update(parser, machine, edit(lines, line_edits))
+        # Then back to the original source
+        check_update(parser, machine, SOURCE)
+
+def test_update_after_consecutive_edits():
+    parser = InputParser(SOURCE)
+    machine = AbstractMachineSimulator(parser.parse())
+    lines = SOURCE.strip().splitlines()
+    for line_edits in [[(6, "E] SCAN (b,accept)")], [(2, "QUEUE Q2")], [(6, None)], [(0, None)], [(4, "Z] SCAN (z,A)")]]:
+        source = edit(lines, line_edits)
+        check_update(parser, machine, source)
+        lines = source.splitlines()
@@ -0,0 +1,46 @@
+import itertools
+import random
+from abstract_simulator import AbstractMachineSimulator
+from machine_optimizer import minimize_scan_machine
+
+def accepts(logic, string):
+    machine = AbstractMachineSimulator({"aux_data": {}, "logic": logic})
+    machine.set_input_tape("#" + string + "#")
+    return machine.run_fast(max_steps=200).accepted
+
+def check_same_language(logic, alphabet):
+    minimized = minimize_scan_machine(logic)
+    # Symbols the machine never reads and the blank have to be handled the same too
+    for length in range(6):
+        for string in itertools.product(alphabet + ["c", "#"], repeat=length):
+            string = "".join(string)
+            assert accepts(minimized, string) == accepts(logic, string), string
+    return minimized
+
+def random_logic(count, alphabet):
+    names = ["S" + str(i) for i in range(count)]
+    logic = {}
+    for name in names:
+        arguments = []
+        for symbol in alphabet + ["#"]:
+            if random.random() < 0.15:
+                continue
+            arguments.append("(" + symbol + "," + random.choice(names + ["accept", "reject", "halt"]) + ")")
+        logic[name] = {"instruction": random.choice(["SCAN", "SCAN RIGHT"]), "arguments": arguments}
+    return logic
+
+def test_duplicate_states_are_merged():
+    logic = {
+        "A": {"instruction": "SCAN", "arguments": ["(a,B)", "(b,C)"]},
+        "B": {"instruction": "SCAN", "arguments": ["(a,D)", "(b,accept)"]},
+        "C": {"instruction": "SCAN RIGHT", "arguments": ["(a,B)", "(b,reject)"]},
+        "D": {"instruction": "SCAN", "arguments": ["(a,B)", "(b,accept)"]},
+        "E": {"instruction": "SCAN", "arguments": ["(a,E)"]}
+    }
+    minimized = check_same_language(logic, ["a", "b"])
+    assert len(minimized) < len(logic)
+
+def test_random_machines_accept_the_same_tapes():
+    random.seed(5)
+    for _ in range(40):
+        check_same_language(random_logic(random.randint(1, 6), ["a", "b"]), ["a", "b"])